@@ -0,0 +1,111 @@
+from fastapi import APIRouter, HTTPException
+from pydantic import BaseModel, field_validator
+from typing import Dict, List, Optional
+from app.services.bundle_store import BundleNotFoundError, get_bundle_store
+from app.models.code_execution import CodeBundle, CodeFile, Language, is_safe_file_name
+
+router = APIRouter()
+
+class BundleFile(BaseModel):
+    """A file uploaded as part of a bundle."""
+    name: str
+    content: str
+    language: Language
+    dependencies: List[str] = []
+    is_entry_point: bool = False
+
+    @field_validator("name")
+    @classmethod
+    def check_name(cls, name: str) -> str:
+        """Only accept relative paths that stay inside the bundle directory."""
+        if not is_safe_file_name(name):
+            raise ValueError("must be a relative path without '..' segments or backslashes")
+        return name
+
+class BundleRequest(BaseModel):
+    """Request model for storing a bundle, either in full or as a delta."""
+    base_bundle_id: Optional[str] = None  # Start from this bundle and apply the changes below
+    files: List[BundleFile] = []  # New or changed files
+    removed_files: List[str] = []  # Files to drop from the base bundle
+    requirements: Optional[List[str]] = None  # None keeps the base bundle's requirements
+
+class BundleResponse(BaseModel):
+    """Response model describing a stored bundle."""
+    bundle_id: str
+    entry_point: Optional[str] = None
+    files: Dict[str, str]  # File name to content hash
+    requirements: List[str] = []
+
+def describe_bundle(bundle_id: str, bundle: CodeBundle) -> Dict:
+    """Build the response for a stored bundle."""
+    return {
+        'bundle_id': bundle_id,
+        'entry_point': bundle.entry_point,
+        'files': {name: file.digest for name, file in bundle.files.items()},
+        'requirements': bundle.requirements
+    }
+
+@router.post("/bundles", response_model=BundleResponse)
+async def create_bundle(request: BundleRequest) -> Dict:
+    """
+    Store a bundle, optionally as changes against a previously stored one.
+
+    Args:
+        request: The files to store, and the base bundle they modify
+
+    Returns:
+        The new bundle id and the content hash of every file in it
+    """
+    files = [
+        CodeFile(
+            name=f.name,
+            content=f.content,
+            language=f.language.value,
+            dependencies=f.dependencies,
+            is_entry_point=f.is_entry_point
+        )
+        for f in request.files
+    ]
+    store = get_bundle_store()
+
+    # The store validates file names and structure before storing anything
+    try:
+        if request.base_bundle_id is None:
+            bundle = CodeBundle(requirements=list(request.requirements or []))
+            for file in files:
+                bundle.add_file(file)
+            bundle_id = store.put(bundle)
+        else:
+            bundle_id, bundle = store.derive(request.base_bundle_id, files, request.removed_files, request.requirements)
+    except BundleNotFoundError as e:
+        raise HTTPException(
+            status_code=404,
+            detail=str(e)
+        )
+    except ValueError as e:
+        raise HTTPException(
+            status_code=400,
+            detail=str(e)
+        )
+
+    return describe_bundle(bundle_id, bundle)
+
+@router.get("/bundles/{bundle_id}", response_model=BundleResponse)
+async def get_bundle(bundle_id: str) -> Dict:
+    """
+    Describe a stored bundle, so clients can tell which files the server already has.
+
+    Args:
+        bundle_id: Id of the stored bundle
+
+    Returns:
+        The bundle id and the content hash of every file in it
+    """
+    try:
+        bundle = get_bundle_store().get(bundle_id)
+    except BundleNotFoundError as e:
+        raise HTTPException(
+            status_code=404,
+            detail=str(e)
+        )
+    return describe_bundle(bundle_id, bundle)
@@ -1,22 +1,17 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import List, Literal, Optional, AsyncGenerator, Union
 from collections import deque
+from contextlib import aclosing
 import json
-import os
 import asyncio
 import logging
-from dotenv import load_dotenv
 from app.services.llm.factory import get_llm_client
+from app.core.metrics import metrics
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
-# Load environment variables
-load_dotenv()
-
 router = APIRouter()
 
 # ----------- Models -----------
@@ -130,38 +125,53 @@ async def process_token(buffer: deque, token: str, index: int, state: dict[str,
 # ----------- Route -----------
 
 @router.post("/chat")
-async def chat(request: ChatRequest):
+async def chat(request: ChatRequest, http_request: Request):
     if not request.messages:
         raise HTTPException(status_code=400, detail="No messages provided")
 
     async def generate_stream_response():
+        index = 0
         try:
             yield await send_start()
 
             client = get_llm_client()
             messages = [{"role": m.role, "content": m.content} for m in request.messages]
 
-            index = 0
             buffer = deque()
             state = {
                 'code_block_open': False,
                 'has_found_code': False
                 }
-            async for chunk in client.chat_completion(messages=messages):
-                try:
-                    content = chunk.choices[0].delta.content
-                except (AttributeError, IndexError):
-                    continue
-
-                if not content:
-                    continue
-
-                async for response_chunk in process_token(buffer, content, index, state):
-                    yield response_chunk
-                index += 1
+            # aclosing() guarantees the upstream stream is closed when we stop early,
+            # whether by disconnect, cancellation or error.
+            async with aclosing(client.chat_completion(messages=messages)) as completion:
+                async for chunk in completion:
+                    if await http_request.is_disconnected():
+                        logger.info(f"Client disconnected after {index} chunks, aborting upstream stream")
+                        metrics.increment("chat.client_disconnects")
+                        metrics.increment("chat.upstream_chunks_before_abort", index)
+                        return
+
+                    try:
+                        content = chunk.choices[0].delta.content
+                    except (AttributeError, IndexError):
+                        continue
+
+                    if not content:
+                        continue
+
+                    async for response_chunk in process_token(buffer, content, index, state):
+                        yield response_chunk
+                    index += 1
 
             yield await send_done()
 
+        except asyncio.CancelledError:
+            # The server cancels the response task when it sees the disconnect first
+            logger.info(f"Stream cancelled after {index} chunks")
+            metrics.increment("chat.streams_cancelled")
+            metrics.increment("chat.upstream_chunks_before_abort", index)
+            raise
         except Exception as e:
             logger.error(f"Error in stream response: {e}")
             yield await send_error(str(e))
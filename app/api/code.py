@@ -1,25 +1,48 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import FileResponse
 from pydantic import BaseModel
-from typing import Dict, Optional, Tuple
-from enum import Enum
+from typing import Dict, List, Literal, Optional, Tuple
+import math
+import asyncio
+import hashlib
+import threading
 from app.services.sandbox import get_sandbox_executor
-from app.models.code_execution import CodeBundle, CodeFile
+from app.services.sandbox.base import SandboxExecutor
+from app.services.sandbox.output import get_output_store
+from app.services.sandbox.scheduler import KEYED_TENANT_PREFIX, Priority, SchedulerRejected, get_scheduler
+from app.services.sandbox.sharding import usable_shards
+from app.services.bundle_store import BundleNotFoundError, get_bundle_store
+from app.models.code_execution import CodeBundle, CodeFile, Language
+from app.core.config import get_settings
+from app.core.metrics import metrics
 
 router = APIRouter()
 
-class Language(str, Enum):
-    """Supported programming languages."""
-    PYTHON = "python-3.12"
-    TYPESCRIPT = "typescript"
-    JAVASCRIPT = "javascript"
-    JAVA = "java"
-    CSHARP = "csharp"
+# How often to check whether the client is still waiting for the result
+DISCONNECT_POLL_INTERVAL = 0.2
 
 class CodeRequest(BaseModel):
     """Request model for code execution."""
     language: Language
-    implementation_code: str
-    test_code: str
+    implementation_code: Optional[str] = None  # Required unless bundle_id is given
+    test_code: Optional[str] = None  # Required unless bundle_id is given
+    requirements: Optional[List[str]] = None  # Third-party packages, resolved from the server's wheelhouse
+    bundle_id: Optional[str] = None  # Previous bundle to reuse; only changed code needs to be sent
+    shards: Optional[int] = None  # Parallel test shards wanted; capped at the server's SANDBOX_MAX_SHARDS
+
+class ResourceUsage(BaseModel):
+    """Resources a run actually used; fields the sandbox could not measure are null."""
+    wall_time_seconds: float
+    cpu_time_seconds: Optional[float] = None
+    peak_memory_bytes: Optional[int] = None
+    process_count: Optional[int] = None
+
+class ResourceLimitsApplied(BaseModel):
+    """Resource limits a run was given."""
+    memory_mb: int
+    cpus: float
+    pids: int
+    timeout_seconds: float
 
 class CodeResponse(BaseModel):
     """Response model for code execution."""
@@ -27,8 +50,36 @@ class CodeResponse(BaseModel):
     stderr: str
     exit_code: int
     error: Optional[str] = None
+    bundle_id: Optional[str] = None  # Send back with only the changed code next time
+    execution_id: Optional[str] = None  # Fetch full output from /code/{execution_id}/output/{stream}
+    stdout_bytes: int = 0  # Size of the complete stdout, even if truncated here
+    stderr_bytes: int = 0  # Size of the complete stderr, even if truncated here
+    stdout_truncated: bool = False
+    stderr_truncated: bool = False
+    usage: Optional[ResourceUsage] = None
+    limits: Optional[ResourceLimitsApplied] = None
+    shards: int = 1  # Shards the tests actually ran in
+
+def build_implementation_file(language: Language, implementation_code: str) -> CodeFile:
+    """Build the implementation file of a bundle."""
+    return CodeFile(
+        name="implementation.py",
+        content=implementation_code.strip(),
+        language=language.value,
+        is_entry_point=False
+    )
+
+def build_test_file(language: Language, test_code: str) -> CodeFile:
+    """Build the test file of a bundle, which depends on the implementation."""
+    return CodeFile(
+        name="test.py",
+        content=test_code.strip(),
+        language=language.value,
+        is_entry_point=True,
+        dependencies=["implementation.py"]
+    )
 
-def build_code_bundle(language: Language, implementation_code: str, test_code: str) -> CodeBundle:
+def build_code_bundle(language: Language, implementation_code: str, test_code: str, requirements: Optional[List[str]] = None) -> CodeBundle:
     """
     Build a code bundle with test and implementation files.
     
@@ -36,57 +87,216 @@ def build_code_bundle(language: Language, implementation_code: str, test_code: s
         language: The programming language to use
         implementation_code: The implementation code
         test_code: The test code
+        requirements: Optional third-party packages the code needs
         
     Returns:
         CodeBundle containing the implementation and test files
     """
     # Create the code bundle
-    bundle = CodeBundle()
+    bundle = CodeBundle(requirements=list(requirements or []))
     
     # Add implementation file
-    impl_file = CodeFile(
-        name="implementation.py",
-        content=implementation_code.strip(),
-        language=language.value,
-        is_entry_point=False
-    )
-    bundle.add_file(impl_file)
+    bundle.add_file(build_implementation_file(language, implementation_code))
     
     # Add test file that depends on implementation
-    test_file = CodeFile(
-        name="test.py",
-        content=test_code.strip(),
-        language=language.value,
-        is_entry_point=True,
-        dependencies=["implementation.py"]
-    )
-    bundle.add_file(test_file)
+    bundle.add_file(build_test_file(language, test_code))
     
     return bundle
 
+def resolve_code_bundle(request: CodeRequest) -> Tuple[str, CodeBundle]:
+    """
+    Build the bundle for a request and record it in the bundle store.
+    
+    With a bundle_id, the stored bundle is reused and only the code present in
+    the request replaces its files.
+    
+    Args:
+        request: The code execution request
+        
+    Returns:
+        Tuple of (bundle id, bundle)
+        
+    Raises:
+        ValueError: If code is missing and no bundle_id is given
+        BundleNotFoundError: If bundle_id is unknown or expired
+    """
+    store = get_bundle_store()
+    if request.bundle_id is None:
+        if request.implementation_code is None or request.test_code is None:
+            raise ValueError("implementation_code and test_code are required when no bundle_id is given")
+        bundle = build_code_bundle(request.language, request.implementation_code, request.test_code, request.requirements)
+        return store.put(bundle), bundle
+    
+    changed_files = []
+    if request.implementation_code is not None:
+        changed_files.append(build_implementation_file(request.language, request.implementation_code))
+    if request.test_code is not None:
+        changed_files.append(build_test_file(request.language, request.test_code))
+    return store.derive(request.bundle_id, changed_files, requirements=request.requirements)
+
+def resolve_shards(requested: Optional[int]) -> int:
+    """
+    Get the number of shards to run a request's tests in.
+    
+    Args:
+        requested: Shards asked for by the client, if any
+        
+    Returns:
+        The requested shard count capped at SANDBOX_MAX_SHARDS, or 1 if none was requested
+        
+    Raises:
+        ValueError: If fewer than one shard is requested
+    """
+    if requested is None:
+        return 1
+    if requested < 1:
+        raise ValueError("shards must be at least 1")
+    return min(requested, max(get_settings().SANDBOX_MAX_SHARDS, 1))
+
+def get_tenant(http_request: Request) -> str:
+    """
+    Identify the tenant a sandbox job is charged to.
+    
+    API keys are hashed so they never appear in metrics; requests without a key
+    fall back to the X-Tenant-ID header and then to the client address. Each
+    source gets its own prefix, so a header cannot pose as a keyed tenant.
+    
+    Args:
+        http_request: The incoming request
+        
+    Returns:
+        Tenant id used for fair-share scheduling and quotas
+    """
+    if api_key := http_request.headers.get("X-API-Key"):
+        return f"{KEYED_TENANT_PREFIX}{hashlib.sha256(api_key.encode()).hexdigest()[:12]}"
+    if tenant_id := http_request.headers.get("X-Tenant-ID"):
+        return f"tenant-{tenant_id}"
+    if http_request.client:
+        return f"ip-{http_request.client.host}"
+    return "anonymous"
+
+def get_priority(http_request: Request, tenant: str) -> Priority:
+    """
+    Decide the priority class of a sandbox job.
+    
+    Clients may always ask for batch with X-Priority. Interactive priority is
+    only given to API-key and client-address tenants, and never to tenants
+    listed in SANDBOX_BATCH_TENANTS; X-Tenant-ID tenants are always batch,
+    since anyone can send that header.
+    
+    Args:
+        http_request: The incoming request
+        tenant: Tenant id from `get_tenant`
+        
+    Returns:
+        The job's priority class
+        
+    Raises:
+        ValueError: If X-Priority is not a known priority
+    """
+    requested = Priority(http_request.headers.get("X-Priority", Priority.INTERACTIVE.value))
+    if tenant in get_settings().SANDBOX_BATCH_TENANTS or tenant.startswith("tenant-"):
+        return Priority.BATCH
+    return requested
+
+async def run_until_disconnected(
+    http_request: Request,
+    executor: SandboxExecutor,
+    bundle: CodeBundle,
+    tenant: str,
+    priority: Priority,
+    shards: int = 1
+) -> Dict:
+    """
+    Queue the bundle with the scheduler and run it off the event loop,
+    cancelling it if the client goes away.
+    
+    Args:
+        http_request: The incoming request, polled for client disconnects
+        executor: The sandbox executor to run the bundle with
+        bundle: The code bundle to execute
+        tenant: Tenant id the job is charged to
+        priority: Priority class of the job
+        shards: Parallel test shards to run the bundle's tests in
+        
+    Returns:
+        Execution results from the executor
+    """
+    cancel_event = threading.Event()
+    # Each shard is a test process of its own, so a sharded run takes a slot per shard
+    execution = asyncio.create_task(get_scheduler().run(
+        lambda: asyncio.to_thread(executor.execute, bundle, cancel_event, tenant, shards),
+        tenant,
+        priority,
+        slots=shards
+    ))
+    try:
+        while True:
+            done, _ = await asyncio.wait({execution}, timeout=DISCONNECT_POLL_INTERVAL)
+            if done:
+                return execution.result()
+            if await http_request.is_disconnected():
+                metrics.increment("code.client_disconnects")
+                # Withdraws a queued job; a running container is stopped via the event
+                cancel_event.set()
+                execution.cancel()
+                return {
+                    'stdout': '',
+                    'stderr': 'Execution cancelled',
+                    'exit_code': -1,
+                    'error': 'cancelled'
+                }
+    except asyncio.CancelledError:
+        cancel_event.set()
+        execution.cancel()
+        raise
+
 @router.post("/code", response_model=CodeResponse)
-async def execute_code(request: CodeRequest) -> Dict:
+async def execute_code(request: CodeRequest, http_request: Request) -> Dict:
     """
     Execute Python code in a sandbox environment.
     
     Args:
         request: The code execution request containing implementation and test code
+        http_request: The raw request, used for tenant, priority and disconnects
         
     Returns:
         Execution results including stdout, stderr, and exit code
     """
+    tenant = get_tenant(http_request)
     try:
-        # Build the code bundle with test and implementation files
-        bundle = build_code_bundle(request.language, request.implementation_code, request.test_code)
+        priority = get_priority(http_request, tenant)
+    except ValueError:
+        raise HTTPException(
+            status_code=400,
+            detail=f"X-Priority must be one of: {', '.join(p.value for p in Priority)}"
+        )
+
+    try:
+        # Build the code bundle with test and implementation files, reusing a stored one if given
+        bundle_id, bundle = resolve_code_bundle(request)
+        shards = usable_shards(bundle.get_entry_point(), resolve_shards(request.shards))
         
         # Get the sandbox executor
         executor = get_sandbox_executor()
         
-        # Execute the code
-        result = executor.execute(bundle)
+        # Execute the code once scheduled, stopping the container if the client disconnects
+        result = await run_until_disconnected(http_request, executor, bundle, tenant, priority, shards)
         
-        return result
+        return {**result, 'bundle_id': bundle_id}
         
+    except BundleNotFoundError as e:
+        raise HTTPException(
+            status_code=404,
+            detail=str(e)
+        )
+    except SchedulerRejected as e:
+        headers = {"Retry-After": str(math.ceil(e.retry_after))} if e.retry_after and math.isfinite(e.retry_after) else None
+        raise HTTPException(
+            status_code=429,
+            detail=e.reason,
+            headers=headers
+        )
     except ValueError as e:
         raise HTTPException(
             status_code=400,
@@ -98,3 +308,23 @@ async def execute_code(request: CodeRequest) -> Dict:
             detail=f"Error executing code: {str(e)}"
         )
 
+@router.get("/code/{execution_id}/output/{stream}")
+async def get_code_output(execution_id: str, stream: Literal["stdout", "stderr"]) -> FileResponse:
+    """
+    Download the full output of an execution, when output spilling is enabled.
+    
+    Args:
+        execution_id: The execution_id returned by /code
+        stream: Which stream to download
+        
+    Returns:
+        The stored output as plain text
+    """
+    store = get_output_store()
+    path = store.get(execution_id, stream) if store is not None else None
+    if path is None:
+        raise HTTPException(
+            status_code=404,
+            detail="Output not found; it may have expired or output storage is disabled"
+        )
+    return FileResponse(path, media_type="text/plain")
@@ -1,4 +1,5 @@
 from functools import lru_cache
+from typing import Optional
 from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
@@ -6,11 +7,80 @@ class Settings(BaseSettings):
     API_V1_STR: str = "/api/v1"
     PROJECT_NAME: str = "TDD AI Assistant Backend"
 
+    # Runtime Settings
+    ENVIRONMENT: str = "development"  # "production" runs code on Fargate
+    LOG_LEVEL: str = "INFO"
+    LOG_FORMAT: str = "json"  # "json" for structured records, "text" for humans
+    LOG_QUEUE_SIZE: int = 10000  # Records buffered for the log writer thread; overflow is dropped
+    LOG_PAYLOAD_MAX_CHARS: int = 200  # Preview length for logged code/output; the rest is hashed
+    LOG_SAMPLE_RATES: dict[str, float] = {}  # Fraction of records kept per category, e.g. {"sandbox.files": 0.1}
+
     # CORS Settings
     BACKEND_CORS_ORIGINS: list[str] = ["http://localhost:5173"]
 
     # AI Model Settings
-    OPENAI_API_KEY: str
+    OPENAI_API_KEY: Optional[str] = None
+    USE_MOCK_DATA: bool = False  # Serve canned responses instead of calling OpenAI
+    LLM_TIMEOUT_SECONDS: float = 60.0  # Per-request timeout for the OpenAI client
+    LLM_MAX_RETRIES: int = 2  # Retries for failed OpenAI requests before streaming starts
+
+    # Hedged LLM requests: if no token arrives within LLM_HEDGE_AFTER_SECONDS, race a second request
+    LLM_HEDGE_ENABLED: bool = False
+    LLM_HEDGE_AFTER_SECONDS: float = 1.5
+    LLM_HEDGE_MODEL: Optional[str] = None  # Model for the hedge request; defaults to the primary's
+    LLM_HEDGE_BASE_URL: Optional[str] = None  # OpenAI-compatible endpoint for the hedge request
+    LLM_HEDGE_API_KEY: Optional[str] = None  # API key for LLM_HEDGE_BASE_URL; defaults to OPENAI_API_KEY
+    LLM_HEDGE_BUDGET_RATIO: float = 0.1  # Hedges allowed per request, on average
+    LLM_HEDGE_BUDGET_BURST: int = 10  # Hedges allowed in a burst
+
+    # Sandbox Settings
+    USE_FINCH: bool = False  # Use Finch instead of Docker as the container CLI
+    SANDBOX_MEMORY_MB: int = 100  # Per-container memory limit (the ceiling when adaptive)
+    SANDBOX_CPUS: float = 0.5  # Per-container CPU limit (the ceiling when adaptive)
+    SANDBOX_PIDS_LIMIT: int = 50  # Per-container process limit (the ceiling when adaptive)
+    SANDBOX_TIMEOUT_SECONDS: float = 5.0  # Per-run timeout (the ceiling when adaptive)
+    SANDBOX_TIMEOUT_GRACE_SECONDS: float = 2.0  # Extra time for container startup and the runner's own timeout report
+
+    # Adaptive sandbox limits, sized per language and tenant from recent usage
+    SANDBOX_ADAPTIVE_LIMITS: bool = False
+    SANDBOX_ADAPTIVE_PERCENTILE: float = 0.95  # Usage percentile limits are based on
+    SANDBOX_ADAPTIVE_HEADROOM: float = 1.5  # Multiplier applied to that percentile
+    SANDBOX_ADAPTIVE_MIN_SAMPLES: int = 20  # Runs needed before limits are adapted
+    SANDBOX_ADAPTIVE_WINDOW: int = 200  # Recent runs kept per language and tenant
+    SANDBOX_ADAPTIVE_MAX_TENANT_KEYS: int = 1000  # Language/tenant pairs tracked; others use the language's history
+    SANDBOX_MIN_MEMORY_MB: int = 32
+    SANDBOX_MIN_CPUS: float = 0.1
+    SANDBOX_MIN_PIDS_LIMIT: int = 10
+    SANDBOX_MIN_TIMEOUT_SECONDS: float = 1.0
+
+    # Bundle store
+    BUNDLE_STORE_MAX_BYTES: int = 64 * 1024 ** 2  # File content kept for delta uploads
+    BUNDLE_STORE_MAX_BUNDLES: int = 10000  # Bundle manifests kept for delta uploads
+
+    # Sandbox output capture
+    SANDBOX_OUTPUT_HEAD_BYTES: int = 32 * 1024  # Start of stdout/stderr returned in responses
+    SANDBOX_OUTPUT_TAIL_BYTES: int = 32 * 1024  # End of stdout/stderr returned in responses
+    SANDBOX_OUTPUT_SPILL_DIR: Optional[str] = None  # Keep full output on disk for later download; disabled when unset
+    SANDBOX_OUTPUT_SPILL_MAX_BYTES: int = 16 * 1024 ** 2  # Per stream, per execution
+    SANDBOX_OUTPUT_SPILL_BUDGET_BYTES: int = 1024 ** 3  # Total disk for spilled output; oldest runs are removed first
+
+    # Sandbox dependency layers
+    SANDBOX_WHEELHOUSE_DIR: Optional[str] = None  # Local wheels; third-party requirements are disabled when unset
+    SANDBOX_LAYER_BUDGET_BYTES: int = 5 * 1024 ** 3  # Disk budget for cached dependency images
+    SANDBOX_LAYER_BUILD_TIMEOUT: int = 300  # Seconds allowed for building one dependency image
+
+    # Sandbox scheduling
+    SANDBOX_MAX_CONCURRENCY: int = 4  # Sandbox jobs running at once
+    SANDBOX_MAX_QUEUE_DEPTH: int = 100  # Jobs waiting across all tenants before new ones are rejected
+    SANDBOX_MAX_TENANT_QUEUE_DEPTH: int = 20  # Jobs one tenant may have waiting
+    SANDBOX_BATCH_QUEUE_RATIO: float = 0.5  # Batch jobs are rejected once the queue is this full
+    SANDBOX_TENANT_RATE: float = 2.0  # Sustained jobs per second per tenant
+    SANDBOX_TENANT_BURST: int = 10  # Jobs a tenant may submit at once
+    SANDBOX_TENANT_WEIGHTS: dict[str, float] = {}  # Fair-share weight per API-key tenant id ("key-..."); default 1.0
+    SANDBOX_BATCH_TENANTS: list[str] = []  # API-key tenant ids ("key-...") whose jobs are always batch
+
+    # Sharded test execution
+    SANDBOX_MAX_SHARDS: int = 4  # Most pytest shards a request may split its tests across
 
     class Config:
         case_sensitive = True
@@ -0,0 +1,151 @@
+import sys
+import copy
+import json
+import queue
+import atexit
+import random
+import hashlib
+import logging
+import logging.handlers
+from typing import Any, Dict, Optional
+from app.core.config import Settings
+from app.core.metrics import metrics
+
+# Set by configure_logging(); defaults apply until then (e.g. in scripts)
+_payload_max_chars = 200
+_sample_rates: Dict[str, float] = {}
+_listener: Optional[logging.handlers.QueueListener] = None
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Queue handler that drops records instead of blocking when the writer falls behind."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The base class formats the record here, on the calling thread, and clears
+        # exc_info; leave all formatting to the listener's formatter instead
+        return copy.copy(record)
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.increment("logging.dropped_records")
+
+class StructuredFormatter(logging.Formatter):
+    """Formats records as one JSON object per line, including `log_event` fields."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if category := getattr(record, "category", None):
+            entry["category"] = category
+        if fields := getattr(record, "fields", None):
+            entry.update(fields)
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class TextFormatter(logging.Formatter):
+    """Human-readable format with `log_event` fields appended as key=value pairs."""
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        if fields := getattr(record, "fields", None):
+            line += " " + " ".join(f"{key}={json.dumps(value, default=str)}" for key, value in fields.items())
+        return line
+
+def configure_logging(settings: Settings) -> None:
+    """
+    Route all logging through a bounded queue drained by a background thread.
+
+    Request handlers only pay for creating the record and a non-blocking queue
+    put; formatting and writing happen on the listener thread.
+
+    Args:
+        settings: Settings providing level, format, queue size, payload limit and sample rates
+    """
+    global _listener, _payload_max_chars, _sample_rates
+
+    _payload_max_chars = settings.LOG_PAYLOAD_MAX_CHARS
+    _sample_rates = dict(settings.LOG_SAMPLE_RATES)
+
+    if _listener is not None:
+        _listener.stop()
+
+    stream_handler = logging.StreamHandler(sys.stderr)
+    if settings.LOG_FORMAT == "json":
+        stream_handler.setFormatter(StructuredFormatter())
+    else:
+        stream_handler.setFormatter(TextFormatter())
+
+    log_queue: queue.Queue = queue.Queue(maxsize=settings.LOG_QUEUE_SIZE)
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(DroppingQueueHandler(log_queue))
+    root.setLevel(settings.LOG_LEVEL)
+
+atexit.register(lambda: _listener.stop() if _listener is not None else None)
+
+def summarize(payload: Optional[str]) -> Dict[str, Any]:
+    """
+    Summarize a potentially large payload (code, stdout) for logging.
+
+    Args:
+        payload: The text to summarize
+
+    Returns:
+        Its size, a short content hash and a truncated preview
+    """
+    payload = payload or ""
+    summary = {
+        "chars": len(payload),
+        "sha256": hashlib.sha256(payload.encode(errors="replace")).hexdigest()[:16],
+    }
+    if _payload_max_chars > 0:
+        summary["preview"] = payload[:_payload_max_chars]
+        summary["truncated"] = len(payload) > _payload_max_chars
+    return summary
+
+def log_event(
+    logger: logging.Logger,
+    level: int,
+    category: str,
+    message: str,
+    payloads: Optional[Dict[str, Optional[str]]] = None,
+    **fields: Any
+) -> None:
+    """
+    Log a structured, sampled event.
+
+    Level and sampling are checked before anything is built, and payloads are
+    only summarized for events that are actually emitted, so disabled or
+    sampled-out events cost almost nothing on the request path.
+
+    Args:
+        logger: Logger to emit through
+        level: Logging level, e.g. logging.INFO
+        category: Sampling category, e.g. "sandbox.files"
+        message: Human-readable message
+        payloads: Large text fields, logged as `summarize()` output
+        **fields: Structured fields added to the record
+    """
+    if not logger.isEnabledFor(level):
+        return
+    rate = _sample_rates.get(category, 1.0)
+    if rate < 1.0 and random.random() >= rate:
+        return
+    if rate < 1.0:
+        fields["sample_rate"] = rate
+    for name, payload in (payloads or {}).items():
+        fields[name] = summarize(payload)
+    logger.log(level, message, extra={"category": category, "fields": fields})
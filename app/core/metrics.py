@@ -0,0 +1,44 @@
+import threading
+from collections import defaultdict
+from typing import Dict
+
+class Metrics:
+    """Minimal in-process counters, gauges and observations, safe to use from worker threads."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, float] = defaultdict(float)
+        self._gauges: Dict[str, float] = {}
+        self._observations: Dict[str, Dict[str, float]] = {}
+
+    def increment(self, name: str, value: float = 1) -> None:
+        """Add `value` to the counter `name`."""
+        with self._lock:
+            self._counters[name] += value
+
+    def set_gauge(self, name: str, value: float) -> None:
+        """Set the current value of the gauge `name`."""
+        with self._lock:
+            self._gauges[name] = value
+
+    def observe(self, name: str, value: float) -> None:
+        """Record a single observation (e.g. a duration) under `name`."""
+        with self._lock:
+            stats = self._observations.get(name)
+            if stats is None:
+                self._observations[name] = {"count": 1, "sum": value, "max": value}
+            else:
+                stats["count"] += 1
+                stats["sum"] += value
+                stats["max"] = max(stats["max"], value)
+
+    def snapshot(self) -> Dict[str, Dict]:
+        """Return a copy of all counters, gauges and observations."""
+        with self._lock:
+            return {
+                "counters": dict(self._counters),
+                "gauges": dict(self._gauges),
+                "observations": {name: dict(stats) for name, stats in self._observations.items()},
+            }
+
+metrics = Metrics()
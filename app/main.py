@@ -1,26 +1,54 @@
+from typing import Optional
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from app.api import chat, code
-
-app = FastAPI(
-    title="TDD AI Assistant Backend",
-    description="Backend API for TDD AI Assistant",
-    version="1.0.0"
-)
-
-# Configure CORS
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["http://localhost:5173"],  # Frontend URL
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
-# Include routers
-app.include_router(chat.router, prefix="/api/v1", tags=["chat"])
-app.include_router(code.router, prefix="/api/v1", tags=["code"])
-
-@app.get("/")
-async def root():
-    return {"message": "Welcome to TDD AI Assistant Backend"} 
\ No newline at end of file
+from app.api import bundles, chat, code
+from app.core.config import Settings, get_settings
+from app.core.log import configure_logging
+from app.core.metrics import metrics
+
+def create_app(settings: Optional[Settings] = None) -> FastAPI:
+    """
+    Build the FastAPI application.
+
+    Heavy dependencies (the OpenAI SDK, sandbox backends) are not imported here;
+    they load on first use so worker boot stays fast.
+
+    Args:
+        settings: Settings to build the app with; defaults to `get_settings()`
+
+    Returns:
+        The configured application
+    """
+    settings = settings or get_settings()
+
+    configure_logging(settings)
+
+    app = FastAPI(
+        title=settings.PROJECT_NAME,
+        description="Backend API for TDD AI Assistant",
+        version="1.0.0"
+    )
+
+    # Configure CORS
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=settings.BACKEND_CORS_ORIGINS,  # Frontend URL
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+
+    # Include routers
+    app.include_router(chat.router, prefix=settings.API_V1_STR, tags=["chat"])
+    app.include_router(code.router, prefix=settings.API_V1_STR, tags=["code"])
+    app.include_router(bundles.router, prefix=settings.API_V1_STR, tags=["bundles"])
+
+    @app.get("/")
+    async def root():
+        return {"message": "Welcome to TDD AI Assistant Backend"}
+
+    @app.get("/metrics")
+    async def get_metrics():
+        return metrics.snapshot()
+
+    return app
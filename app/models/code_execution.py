@@ -1,7 +1,30 @@
+import json
+import hashlib
 from dataclasses import dataclass, field
+from enum import Enum
+from functools import cached_property
 from typing import Dict, List, Optional
 from pathlib import Path
 
+class Language(str, Enum):
+    """Supported programming languages; each runs on the `python-sandbox:<value>` image."""
+    PYTHON = "python-3.12"
+    TYPESCRIPT = "typescript"
+    JAVASCRIPT = "javascript"
+    JAVA = "java"
+    CSHARP = "csharp"
+
+def is_safe_file_name(name: str) -> bool:
+    """
+    Check that a file name stays inside the directory a bundle is written to.
+    
+    Names are relative paths using `/`; absolute paths, `.`/`..` or empty
+    segments, backslashes and NUL characters are rejected.
+    """
+    if not name or name.startswith("/") or "\\" in name or "\0" in name:
+        return False
+    return all(part not in ("", ".", "..") for part in name.split("/"))
+
 @dataclass
 class CodeFile:
     """Represents a single code file with its content and metadata."""
@@ -11,11 +34,22 @@ class CodeFile:
     dependencies: List[str] = field(default_factory=list)  # File dependencies
     is_entry_point: bool = False
 
+    @cached_property
+    def digest(self) -> str:
+        """
+        Content hash of the file, used to store and cache it by content.
+        
+        Computed once per file object; files are replaced, never edited, when
+        their content changes.
+        """
+        return hashlib.sha256(self.content.encode()).hexdigest()
+
 @dataclass
 class CodeBundle:
     """Represents a collection of code files that form a complete program."""
     files: Dict[str, CodeFile] = field(default_factory=dict)
     entry_point: Optional[str] = None
+    requirements: List[str] = field(default_factory=list)  # Third-party packages, e.g. "numpy==2.1.0"
     
     def add_file(self, file: CodeFile) -> None:
         """Add a file to the bundle."""
@@ -29,6 +63,23 @@ class CodeBundle:
             return self.files.get(self.entry_point)
         return None
     
+    def manifest_id(self) -> str:
+        """
+        Get the content-addressed id of the bundle.
+        
+        Two bundles with the same files (by name, content and metadata), entry
+        point and requirements always get the same id.
+        """
+        manifest = {
+            "files": [
+                [f.name, f.digest, f.language, sorted(f.dependencies), f.is_entry_point]
+                for f in sorted(self.files.values(), key=lambda f: f.name)
+            ],
+            "entry_point": self.entry_point,
+            "requirements": sorted(self.requirements),
+        }
+        return hashlib.sha256(json.dumps(manifest, sort_keys=True).encode()).hexdigest()
+    
     def get_dependencies(self, file_name: str) -> List[CodeFile]:
         """Get all dependencies for a given file."""
         file = self.files.get(file_name)
@@ -49,6 +100,10 @@ class CodeBundle:
         if not self.entry_point:
             return False
         
+        # File names become paths on the host when the bundle is executed
+        if not all(is_safe_file_name(name) for name in self.files):
+            return False
+        
         # Check that all dependencies exist
         for file in self.files.values():
             for dep in file.dependencies:
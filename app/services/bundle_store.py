@@ -0,0 +1,188 @@
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+from app.core.config import get_settings
+from app.core.metrics import metrics
+from app.models.code_execution import CodeBundle, CodeFile, is_safe_file_name
+
+INVALID_BUNDLE_MESSAGE = "Invalid bundle structure: it needs an entry point and all dependencies must be included"
+
+class BundleNotFoundError(Exception):
+    """Raised when a bundle id is unknown or its content has been evicted."""
+
+@dataclass
+class FileEntry:
+    """A file in a manifest; its content lives in the blob store under `digest`."""
+    name: str
+    digest: str
+    language: str
+    dependencies: List[str] = field(default_factory=list)
+    is_entry_point: bool = False
+
+@dataclass
+class BundleManifest:
+    """The stored shape of a bundle, referencing file contents by hash."""
+    files: Dict[str, FileEntry]
+    entry_point: Optional[str]
+    requirements: List[str]
+
+class BundleStore:
+    """
+    In-memory content-addressed store of code bundles.
+
+    File contents are stored once per hash and shared between bundles, so a
+    client can build a new bundle from a previous bundle id plus only the files
+    that changed. Contents are evicted LRU by total size and manifests LRU by
+    count; a bundle whose content was evicted is reported as not found and the
+    client falls back to a full upload.
+    """
+
+    def __init__(self, max_bytes: int, max_bundles: int):
+        """
+        Initialize the bundle store.
+
+        Args:
+            max_bytes: Total size of file contents to keep
+            max_bundles: Number of bundle manifests to keep
+        """
+        self.max_bytes = max_bytes
+        self.max_bundles = max_bundles
+        self._blobs: "OrderedDict[str, str]" = OrderedDict()
+        self._blob_bytes = 0
+        self._manifests: "OrderedDict[str, BundleManifest]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, bundle: CodeBundle) -> str:
+        """
+        Store a bundle.
+
+        Args:
+            bundle: The bundle to store
+
+        Returns:
+            The bundle id (its manifest hash)
+            
+        Raises:
+            ValueError: If a file name is unsafe or the bundle structure is invalid
+        """
+        for name in bundle.files:
+            if not is_safe_file_name(name):
+                raise ValueError(f"Invalid file name: {name!r}")
+        if not bundle.validate():
+            raise ValueError(INVALID_BUNDLE_MESSAGE)
+        
+        bundle_id = bundle.manifest_id()
+        with self._lock:
+            for file in bundle.files.values():
+                self._put_blob(file.digest, file.content)
+            self._manifests[bundle_id] = BundleManifest(
+                files={
+                    f.name: FileEntry(f.name, f.digest, f.language, list(f.dependencies), f.is_entry_point)
+                    for f in bundle.files.values()
+                },
+                entry_point=bundle.entry_point,
+                requirements=list(bundle.requirements)
+            )
+            self._manifests.move_to_end(bundle_id)
+            while len(self._manifests) > self.max_bundles:
+                self._manifests.popitem(last=False)
+            self._evict_blobs()
+        return bundle_id
+
+    def get(self, bundle_id: str) -> CodeBundle:
+        """
+        Load a bundle.
+
+        Files are returned as new objects, so callers may modify them freely.
+
+        Args:
+            bundle_id: Id returned by `put`
+
+        Returns:
+            The stored bundle
+
+        Raises:
+            BundleNotFoundError: If the bundle or any of its contents is gone
+        """
+        with self._lock:
+            manifest = self._manifests.get(bundle_id)
+            if manifest is None:
+                metrics.increment("bundle_store.misses")
+                raise BundleNotFoundError(f"Unknown bundle: {bundle_id}")
+
+            bundle = CodeBundle(requirements=list(manifest.requirements))
+            for entry in manifest.files.values():
+                content = self._blobs.get(entry.digest)
+                if content is None:
+                    metrics.increment("bundle_store.misses")
+                    raise BundleNotFoundError(f"Bundle {bundle_id} has expired, please upload it again")
+                self._blobs.move_to_end(entry.digest)
+                bundle.add_file(CodeFile(
+                    name=entry.name,
+                    content=content,
+                    language=entry.language,
+                    dependencies=list(entry.dependencies),
+                    is_entry_point=entry.is_entry_point
+                ))
+            bundle.entry_point = manifest.entry_point
+            self._manifests.move_to_end(bundle_id)
+            metrics.increment("bundle_store.hits")
+            return bundle
+
+    def derive(
+        self,
+        base_bundle_id: str,
+        changed_files: List[CodeFile],
+        removed_files: Optional[List[str]] = None,
+        requirements: Optional[List[str]] = None
+    ) -> Tuple[str, CodeBundle]:
+        """
+        Build and store a new bundle from a stored one plus a delta.
+
+        Args:
+            base_bundle_id: Id of the bundle to start from
+            changed_files: Files to add or replace
+            removed_files: Names of files to drop
+            requirements: New requirements, or None to keep the base bundle's
+
+        Returns:
+            Tuple of (new bundle id, new bundle)
+
+        Raises:
+            BundleNotFoundError: If the base bundle is unknown or expired
+            ValueError: If the resulting bundle is invalid; nothing is stored then
+        """
+        bundle = self.get(base_bundle_id)
+        for name in removed_files or []:
+            bundle.files.pop(name, None)
+            if bundle.entry_point == name:
+                bundle.entry_point = None
+        for file in changed_files:
+            bundle.add_file(file)
+        if requirements is not None:
+            bundle.requirements = list(requirements)
+
+        metrics.increment("bundle_store.delta_uploads")
+        metrics.increment("bundle_store.files_reused", max(len(bundle.files) - len(changed_files), 0))
+        return self.put(bundle), bundle
+
+    def _put_blob(self, digest: str, content: str) -> None:
+        if digest in self._blobs:
+            self._blobs.move_to_end(digest)
+            return
+        self._blobs[digest] = content
+        self._blob_bytes += len(content)
+
+    def _evict_blobs(self) -> None:
+        while self._blob_bytes > self.max_bytes and len(self._blobs) > 1:
+            _, content = self._blobs.popitem(last=False)
+            self._blob_bytes -= len(content)
+            metrics.increment("bundle_store.evicted_files")
+
+@lru_cache()
+def get_bundle_store() -> BundleStore:
+    """Get the process-wide bundle store."""
+    settings = get_settings()
+    return BundleStore(max_bytes=settings.BUNDLE_STORE_MAX_BYTES, max_bundles=settings.BUNDLE_STORE_MAX_BUNDLES)
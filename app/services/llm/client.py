@@ -1,20 +1,30 @@
 from openai import OpenAI
-import os
 from typing import List, Dict, Any, Optional, AsyncGenerator
 from pydantic import BaseModel
 import asyncio
+import logging
+from app.core.config import get_settings
+from app.core.metrics import metrics
+
+logger = logging.getLogger(__name__)
 
 class Message(BaseModel):
     role: str
     content: str
 
 class LLMClient:
-    def __init__(self, api_key: Optional[str] = None):
-        """Initialize the LLM client."""
-        self.api_key = api_key or os.getenv("OPENAI_API_KEY")
+    def __init__(self, api_key: Optional[str] = None, base_url: Optional[str] = None):
+        """Initialize the LLM client, optionally against another OpenAI-compatible endpoint."""
+        settings = get_settings()
+        self.api_key = api_key or settings.OPENAI_API_KEY
         if not self.api_key:
             raise ValueError("OpenAI API key is required")
-        self.client = OpenAI(api_key=self.api_key)
+        self.client = OpenAI(
+            api_key=self.api_key,
+            base_url=base_url,
+            timeout=settings.LLM_TIMEOUT_SECONDS,
+            max_retries=settings.LLM_MAX_RETRIES
+        )
 
     async def chat_completion(
         self,
@@ -32,9 +42,36 @@ class LLMClient:
                 stream=stream
             )
 
-        # Run the OpenAI API call in a thread pool
-        stream = await asyncio.to_thread(create_stream)
+        # Run the OpenAI API call in a thread pool. Cancelling us cannot stop that
+        # thread, so if we are cancelled first (e.g. a hedge won), close the
+        # stream as soon as the call returns instead of leaving it generating.
+        creating = asyncio.ensure_future(asyncio.to_thread(create_stream))
+        try:
+            stream = await asyncio.shield(creating)
+        except asyncio.CancelledError:
+            creating.add_done_callback(self._close_abandoned_stream)
+            raise
         
-        # Process the stream asynchronously
-        for chunk in stream:
-            yield chunk 
\ No newline at end of file
+        # Pull each chunk in the thread pool as well so the event loop stays free
+        # to notice client disconnects and cancel us between chunks.
+        iterator = iter(stream)
+        completed = False
+        try:
+            while (chunk := await asyncio.to_thread(next, iterator, None)) is not None:
+                yield chunk
+            completed = True
+        finally:
+            if not completed:
+                # Cancelled or abandoned mid-stream: close the upstream HTTP response
+                # so OpenAI stops generating tokens nobody will read.
+                logger.info("Closing upstream LLM stream before completion")
+                metrics.increment("llm.upstream_streams_closed")
+                await asyncio.to_thread(stream.close)
+
+    def _close_abandoned_stream(self, creating: asyncio.Future) -> None:
+        """Close a stream whose request finished after its caller was cancelled."""
+        if creating.cancelled() or creating.exception() is not None:
+            return
+        logger.info("Closing upstream LLM stream created after cancellation")
+        metrics.increment("llm.upstream_streams_closed")
+        asyncio.get_running_loop().run_in_executor(None, creating.result().close)
@@ -1,13 +1,45 @@
-import os
-from typing import Optional
-from .client import LLMClient
-from .mock_client import MockLLMClient
+from functools import lru_cache
+from typing import TYPE_CHECKING, Optional
+from app.core.config import get_settings
 
-def get_llm_client(use_mock: Optional[bool] = None) -> LLMClient | MockLLMClient:
+if TYPE_CHECKING:
+    from .client import LLMClient
+    from .hedged import HedgedLLMClient
+    from .mock_client import MockLLMClient
+
+def get_llm_client(use_mock: Optional[bool] = None) -> "LLMClient | MockLLMClient | HedgedLLMClient":
     """Get the appropriate LLM client based on configuration."""
+    settings = get_settings()
     if use_mock is None:
-        use_mock = os.getenv("USE_MOCK_DATA", "false").lower() == "true"
+        use_mock = settings.USE_MOCK_DATA
     
+    # Imported here so the OpenAI SDK is only loaded once a real client is needed
     if use_mock:
+        from .mock_client import MockLLMClient
         return MockLLMClient()
-    return LLMClient() 
\ No newline at end of file
+
+    from .client import LLMClient
+    if not settings.LLM_HEDGE_ENABLED:
+        return LLMClient()
+    return _get_hedged_client()
+
+@lru_cache()
+def _get_hedged_client() -> "HedgedLLMClient":
+    """Get the process-wide hedged client, so its hedge budget is shared across requests."""
+    from .client import LLMClient
+    from .hedged import HedgedLLMClient
+
+    settings = get_settings()
+    primary = LLMClient()
+    if settings.LLM_HEDGE_BASE_URL:
+        secondary = LLMClient(api_key=settings.LLM_HEDGE_API_KEY, base_url=settings.LLM_HEDGE_BASE_URL)
+    else:
+        secondary = primary
+    return HedgedLLMClient(
+        primary=primary,
+        secondary=secondary,
+        hedge_after=settings.LLM_HEDGE_AFTER_SECONDS,
+        budget_ratio=settings.LLM_HEDGE_BUDGET_RATIO,
+        budget_burst=settings.LLM_HEDGE_BUDGET_BURST,
+        secondary_model=settings.LLM_HEDGE_MODEL
+    )
\ No newline at end of file
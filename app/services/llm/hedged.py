@@ -0,0 +1,144 @@
+import time
+import asyncio
+import logging
+from typing import Any, AsyncGenerator, Dict, List, Optional
+from app.core.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+class HedgeBudget:
+    """
+    Caps hedging to a fraction of requests.
+
+    Every request earns `ratio` tokens and every hedge spends one, with at most
+    `burst` tokens saved up, so a slow upstream cannot double our load.
+    """
+
+    def __init__(self, ratio: float, burst: int):
+        self.ratio = ratio
+        self.burst = burst
+        self.tokens = float(burst)
+
+    def earn(self) -> None:
+        self.tokens = min(self.burst, self.tokens + self.ratio)
+
+    def try_spend(self) -> bool:
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+class HedgedLLMClient:
+    """
+    Wraps two LLM clients and races them to cut tail time-to-first-token.
+
+    The primary request starts immediately. If it has not produced a chunk
+    within `hedge_after` seconds (or fails before doing so), a second request is
+    started on the secondary client, budget permitting. Whichever yields a chunk
+    first is streamed to the caller and the other is cancelled, which closes its
+    upstream stream.
+    """
+
+    def __init__(
+        self,
+        primary: Any,
+        secondary: Any,
+        hedge_after: float,
+        budget_ratio: float = 0.1,
+        budget_burst: int = 10,
+        secondary_model: Optional[str] = None
+    ):
+        """
+        Initialize the hedged client.
+
+        Args:
+            primary: Client used for every request
+            secondary: Client used for hedge requests (may be the same client)
+            hedge_after: Seconds to wait for the primary's first chunk before hedging
+            budget_ratio: Hedges allowed per request, on average
+            budget_burst: Hedges allowed in a burst
+            secondary_model: Model for hedge requests; defaults to the requested model
+        """
+        self.primary = primary
+        self.secondary = secondary
+        self.hedge_after = hedge_after
+        self.secondary_model = secondary_model
+        self.budget = HedgeBudget(budget_ratio, budget_burst)
+
+    async def chat_completion(
+        self,
+        messages: List[Dict[str, str]],
+        model: str = "gpt-4o-mini",
+        temperature: float = 0.7,
+        stream: bool = True
+    ) -> AsyncGenerator[Any, None]:
+        """Stream a chat completion from whichever upstream answers first."""
+        self.budget.earn()
+        started = time.monotonic()
+
+        primary = self.primary.chat_completion(messages=messages, model=model, temperature=temperature, stream=stream)
+        contenders = {asyncio.ensure_future(anext(primary)): primary}
+        pending = set(contenders)
+        hedged = False
+        error: Optional[BaseException] = None
+        winner = None
+
+        try:
+            while winner is None:
+                timeout = None if hedged else max(self.hedge_after - (time.monotonic() - started), 0)
+                done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+                for task in done:
+                    exc = task.exception()
+                    if exc is None or isinstance(exc, StopAsyncIteration):
+                        winner = task
+                        break
+                    error = exc
+                if winner is not None:
+                    break
+
+                if not hedged:
+                    # Primary is slow or has already failed: try the secondary
+                    hedged = True
+                    if self.budget.try_spend():
+                        metrics.increment("llm.hedge.started")
+                        logger.info(f"No first token after {time.monotonic() - started:.2f}s, starting hedge request")
+                        secondary = self.secondary.chat_completion(
+                            messages=messages,
+                            model=self.secondary_model or model,
+                            temperature=temperature,
+                            stream=stream
+                        )
+                        hedge_task = asyncio.ensure_future(anext(secondary))
+                        contenders[hedge_task] = secondary
+                        pending.add(hedge_task)
+                    else:
+                        metrics.increment("llm.hedge.budget_exhausted")
+
+                if not pending:
+                    raise error
+
+            metrics.observe("llm.ttft_seconds", time.monotonic() - started)
+            if hedged and len(contenders) > 1:
+                metrics.increment("llm.hedge.won_by_hedge" if contenders[winner] is not primary else "llm.hedge.won_by_primary")
+
+            await self._cancel_losers(contenders, winner)
+
+            if isinstance(winner.exception(), StopAsyncIteration):
+                return
+            yield winner.result()
+            async for chunk in contenders[winner]:
+                yield chunk
+        finally:
+            await self._cancel_losers(contenders, winner)
+            if winner is not None:
+                await contenders[winner].aclose()
+
+    async def _cancel_losers(self, contenders: Dict[asyncio.Future, Any], winner: Optional[asyncio.Future]) -> None:
+        """Cancel every request but the winner and close its stream."""
+        losers = [task for task in contenders if task is not winner]
+        for task in losers:
+            task.cancel()
+        await asyncio.gather(*losers, return_exceptions=True)
+        for task in losers:
+            await contenders[task].aclose()
@@ -16,8 +16,16 @@ class MockChunk:
         self.choices = [MockChoice(MockDelta(content))]
 
 class MockLLMClient:
-    def __init__(self):
-        """Initialize the mock LLM client."""
+    def __init__(self, delay: float = 0.1, first_token_delay: Optional[float] = None):
+        """
+        Initialize the mock LLM client.
+        
+        Args:
+            delay: Seconds to wait before each chunk
+            first_token_delay: Seconds to wait before the first chunk, if different from `delay`
+        """
+        self.delay = delay
+        self.first_token_delay = delay if first_token_delay is None else first_token_delay
         self.mock_responses = [
             MockChunk("Here's a concise Python implementation for the `add` function:\n\n"),
             MockChunk("```python\n"),
@@ -39,6 +47,6 @@ class MockLLMClient:
         stream: bool = True
     ) -> AsyncGenerator[Any, None]:
         """Yield mock responses asynchronously."""
-        for chunk in self.mock_responses:
-            await asyncio.sleep(0.1)  # simulate delay
+        for i, chunk in enumerate(self.mock_responses):
+            await asyncio.sleep(self.first_token_delay if i == 0 else self.delay)  # simulate delay
             yield chunk
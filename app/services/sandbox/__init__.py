@@ -1,19 +1,21 @@
-import os
-from typing import Optional
+from functools import lru_cache
+from app.core.config import get_settings
 from .base import SandboxExecutor
-from .docker import DockerSandboxExecutor
-from .fargate import FargateSandboxExecutor
 
+@lru_cache()
 def get_sandbox_executor() -> SandboxExecutor:
     """
     Get the appropriate sandbox executor based on the environment.
     
+    The executor is created once per process, since creating it probes the
+    container runtime. Backends are imported lazily so only the one in use is loaded.
+    
     Returns:
         SandboxExecutor instance
     """
-    env = os.getenv('ENVIRONMENT', 'development')
-    
-    if env == 'production':
+    if get_settings().ENVIRONMENT == 'production':
+        from .fargate import FargateSandboxExecutor
         return FargateSandboxExecutor()
     else:
-        return DockerSandboxExecutor() 
\ No newline at end of file
+        from .docker import DockerSandboxExecutor
+        return DockerSandboxExecutor()
\ No newline at end of file
@@ -1,24 +1,40 @@
 from abc import ABC, abstractmethod
+from collections import OrderedDict
 from typing import Dict, Optional, Tuple
 import logging
+import threading
 from app.models.code_execution import CodeBundle, CodeFile
+from app.core.metrics import metrics
 
 logger = logging.getLogger(__name__)
 
+# Number of per-file validation results kept, keyed by language and content hash
+VALIDATION_CACHE_SIZE = 4096
+
 class SandboxExecutor(ABC):
     """Abstract base class for sandbox executors."""
     
     def __init__(self):
         """Initialize the sandbox executor."""
-        pass
+        self._validation_cache: "OrderedDict[Tuple[str, str], Optional[str]]" = OrderedDict()
+        self._validation_lock = threading.Lock()
     
     @abstractmethod
-    def execute(self, bundle: CodeBundle) -> Dict[str, str]:
+    def execute(
+        self,
+        bundle: CodeBundle,
+        cancel_event: Optional[threading.Event] = None,
+        tenant: Optional[str] = None,
+        shards: int = 1
+    ) -> Dict[str, str]:
         """
         Execute code bundle in the sandbox environment.
         
         Args:
             bundle: The code bundle to execute
+            cancel_event: Set by the caller to abandon the run (e.g. client disconnected)
+            tenant: Tenant the run is charged to, if known
+            shards: Worker processes to split the entry point's tests across
             
         Returns:
             Dictionary containing execution results
@@ -75,10 +91,27 @@ class SandboxExecutor(ABC):
         }
         
         for file in bundle.files.values():
-            patterns = dangerous_patterns.get(file.language.lower(), [])
-            for pattern in patterns:
-                if pattern in file.content:
-                    return False, f"File {file.name} contains potentially dangerous operation: {pattern}"
+            # Unchanged files (same content hash) reuse their previous scan result
+            key = (file.language.lower(), file.digest)
+            with self._validation_lock:
+                cached = key in self._validation_cache
+                if cached:
+                    self._validation_cache.move_to_end(key)
+                    found = self._validation_cache[key]
+            
+            if cached:
+                metrics.increment("sandbox.validation_cache.hits")
+            else:
+                metrics.increment("sandbox.validation_cache.misses")
+                patterns = dangerous_patterns.get(file.language.lower(), [])
+                found = next((pattern for pattern in patterns if pattern in file.content), None)
+                with self._validation_lock:
+                    self._validation_cache[key] = found
+                    if len(self._validation_cache) > VALIDATION_CACHE_SIZE:
+                        self._validation_cache.popitem(last=False)
+            
+            if found:
+                return False, f"File {file.name} contains potentially dangerous operation: {found}"
         
         return True, None
     
@@ -1,29 +1,65 @@
 import os
+import json
+import time
+import uuid
 import logging
 import tempfile
+import threading
 import subprocess
-from typing import Dict
+from dataclasses import replace
+from typing import Dict, List, Optional, Tuple
 from pathlib import Path
 from .base import SandboxExecutor
+from .layers import DependencyLayerCache, get_layer_cache
+from .output import STREAMS, BoundedCapture, OutputStore, get_output_store
+from .limits import OOM_EXIT_CODE, AdaptiveLimitPolicy, ResourceLimits, UsageSample, get_limit_policy
+from .sharding import SHARD_PLAN_FILE, TestDurationHistory, collect_tests, get_duration_history, plan_shards, usable_shards
 from app.models.code_execution import CodeBundle, CodeFile
+from app.core.config import get_settings
+from app.core.log import log_event
+from app.core.metrics import metrics
 
 logger = logging.getLogger(__name__)
 
+# Prefix of the usage line runner.py prints last on stderr
+USAGE_MARKER = "__SANDBOX_USAGE__"
+# Prefix of the shard results line runner.py prints just before the usage line
+SHARDS_MARKER = "__SANDBOX_SHARDS__"
+
 class DockerSandboxExecutor(SandboxExecutor):
     """Executes code in a Docker container or Finch container."""
     
-    def __init__(self, timeout: int = 5):
+    def __init__(
+        self,
+        timeout: Optional[float] = None,
+        poll_interval: float = 0.1,
+        layer_cache: Optional[DependencyLayerCache] = None,
+        output_store: Optional[OutputStore] = None,
+        limit_policy: Optional[AdaptiveLimitPolicy] = None,
+        duration_history: Optional[TestDurationHistory] = None
+    ):
         """
         Initialize the Docker/Finch sandbox executor.
         
         Args:
-            timeout: Maximum execution time in seconds
+            timeout: Maximum execution time in seconds; when set, overrides the limit policy
+            poll_interval: How often to check for cancellation while the container runs
+            layer_cache: Cache of dependency images for bundles with requirements
+            output_store: Where full output is spilled; defaults to the configured store, if any
+            limit_policy: Sizes per-run resource limits; defaults to the configured policy
+            duration_history: Per-test durations used to balance shards; defaults to the process-wide history
         """
         super().__init__()
         self.timeout = timeout
-        self.use_finch = os.getenv('USE_FINCH', 'false').lower() == 'true'
+        self.poll_interval = poll_interval
+        self.use_finch = get_settings().USE_FINCH
+        self.timeout_grace = get_settings().SANDBOX_TIMEOUT_GRACE_SECONDS
         self.container_command = self._get_container_command()
         self._check_container_availability()
+        self.layer_cache = layer_cache or get_layer_cache(self.container_command)
+        self.output_store = output_store or get_output_store()
+        self.limit_policy = limit_policy or get_limit_policy()
+        self.duration_history = duration_history or get_duration_history()
     
     def _get_container_command(self) -> str:
         """Get the full path to the container command."""
@@ -99,19 +135,276 @@ class DockerSandboxExecutor(SandboxExecutor):
         test_file = bundle.get_entry_point()
         if not test_file or not test_file.name.endswith('.py'):
             return
+        
+        # Only two-file bundles built by /code have an implementation to import;
+        # multi-file bundles from /bundles import their own modules
+        if 'implementation.py' not in bundle.files or test_file.name == 'implementation.py':
+            return
             
         # Check if the import statement is already present
         import_statement = "from implementation import *"
         if import_statement not in test_file.content:
-            # Add the import statement at the beginning of the file
-            test_file.content = f"{import_statement}\n\n{test_file.content}"
+            # Add the import statement at the beginning of the file. The file is
+            # replaced rather than edited, since stored bundles may share file objects.
+            bundle.files[test_file.name] = replace(test_file, content=f"{import_statement}\n\n{test_file.content}")
+    
+    def _stop_container(self, container_name: str, process: subprocess.Popen) -> None:
+        """
+        Stop and remove a running container by name.
+        
+        Killing the CLI process alone leaves the container running, so the
+        container itself is force-removed before the CLI process is reaped.
+        
+        Args:
+            container_name: The name passed to `run --name`
+            process: The CLI process attached to the container
+        """
+        try:
+            result = subprocess.run(
+                [self.container_command, 'rm', '-f', container_name],
+                capture_output=True,
+                text=True,
+                timeout=10,
+                env=os.environ
+            )
+            if result.returncode == 0:
+                metrics.increment("sandbox.containers_reclaimed")
+            else:
+                logger.warning(f"Failed to remove container {container_name}: {result.stderr.strip()}")
+        except Exception as e:
+            logger.warning(f"Failed to remove container {container_name}: {str(e)}")
+        finally:
+            process.kill()
+            process.wait()
+    
+    def _run_container(
+        self,
+        container_cmd: List[str],
+        container_name: str,
+        execution_id: str,
+        timeout: float,
+        cancel_event: Optional[threading.Event]
+    ) -> Dict:
+        """
+        Run the container until it exits, times out or is cancelled.
+        
+        stdout and stderr are drained on reader threads into bounded captures, so
+        memory use is capped however much the code prints; full output is
+        optionally spilled to the output store.
+        
+        Args:
+            container_cmd: The container CLI command to run
+            container_name: The name passed to `run --name`
+            execution_id: Id under which spilled output is stored
+            timeout: Seconds the code may run; runner.py enforces this itself, and the
+                container is only force-removed after an extra `timeout_grace` seconds
+            cancel_event: Set by the caller to stop the container early
+            
+        Returns:
+            Dictionary containing execution results, output sizes and resource usage
+        """
+        settings = get_settings()
+        spill_files = {}
+        if self.output_store is not None:
+            spill_files = {stream: self.output_store.open(execution_id, stream) for stream in STREAMS}
+        captures = {
+            stream: BoundedCapture(
+                settings.SANDBOX_OUTPUT_HEAD_BYTES,
+                settings.SANDBOX_OUTPUT_TAIL_BYTES,
+                spill=spill_files.get(stream),
+                spill_limit=self.output_store.max_bytes_per_stream if self.output_store else 0
+            )
+            for stream in STREAMS
+        }
+        
+        # Execute in container
+        started = time.monotonic()
+        process = subprocess.Popen(
+            container_cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            env=os.environ,  # pass environment variables for Finch
+        )
+        readers = [
+            threading.Thread(target=captures[stream].drain, args=(getattr(process, stream),), daemon=True)
+            for stream in STREAMS
+        ]
+        for reader in readers:
+            reader.start()
+        
+        error = None
+        message = None
+        try:
+            deadline = started + timeout + self.timeout_grace
+            while True:
+                try:
+                    process.wait(timeout=self.poll_interval)
+                    break
+                except subprocess.TimeoutExpired:
+                    if cancel_event is not None and cancel_event.is_set():
+                        logger.info(f"Execution cancelled, stopping container {container_name}")
+                        metrics.increment("sandbox.executions_cancelled")
+                        metrics.increment("sandbox.reclaimed_seconds", max(deadline - time.monotonic(), 0))
+                        self._stop_container(container_name, process)
+                        error, message = 'cancelled', 'Execution cancelled'
+                        break
+                    if time.monotonic() >= deadline:
+                        metrics.increment("sandbox.executions_timed_out")
+                        self._stop_container(container_name, process)
+                        error, message = 'timeout', f'Execution timed out after {timeout} seconds'
+                        break
+            
+            wall_time = time.monotonic() - started
+            for reader in readers:
+                reader.join(timeout=self.poll_interval * 10)
+        finally:
+            process.stdout.close()
+            process.stderr.close()
+            for spill_file in spill_files.values():
+                spill_file.close()
+        
+        stdout = captures['stdout'].text()
+        stderr, reported_usage, usage_line_bytes = self._extract_report(captures['stderr'].text(), USAGE_MARKER)
+        stderr, shard_report, shard_line_bytes = self._extract_report(stderr, SHARDS_MARKER)
+        stderr_bytes = captures['stderr'].total_bytes - usage_line_bytes - shard_line_bytes
+        if self.output_store is not None:
+            # The stored stderr must not include the report lines either
+            self.output_store.finish(execution_id, max_bytes={'stderr': stderr_bytes})
+        
+        usage = {'cpu_time_seconds': None, 'peak_memory_bytes': None, 'process_count': None}
+        if reported_usage is not None:
+            usage.update({key: reported_usage.get(key) for key in usage})
+        usage['wall_time_seconds'] = wall_time
+        if error is None and reported_usage is not None and reported_usage.get('timed_out'):
+            # runner.py stopped the code at its timeout and has already said so on stderr
+            metrics.increment("sandbox.executions_timed_out")
+            error = 'timeout'
+        if reported_usage is not None:
+            # The OOM killer picks the test process, so the container's exit code does not show it
+            oom_killed = reported_usage.get('oom_killed') is True
+        else:
+            oom_killed = process.returncode == OOM_EXIT_CODE
+        if message:
+            stderr = f"{stderr}\n{message}" if stderr else message
+        
+        for stream, capture in captures.items():
+            metrics.observe(f"sandbox.output_bytes.{stream}", capture.total_bytes)
+            if capture.truncated:
+                metrics.increment(f"sandbox.output_truncated.{stream}")
+        
+        log_event(
+            logger, logging.INFO, "sandbox.result", "Sandbox execution finished",
+            container=container_name, exit_code=process.returncode, error=error,
+            stdout_bytes=captures['stdout'].total_bytes, stderr_bytes=captures['stderr'].total_bytes,
+            payloads={"stdout": stdout, "stderr": stderr}
+        )
+        return {
+            'stdout': stdout,
+            'stderr': stderr,
+            'exit_code': -1 if error else process.returncode,
+            'error': error,
+            'execution_id': execution_id,
+            'stdout_bytes': captures['stdout'].total_bytes,
+            'stderr_bytes': stderr_bytes,
+            'stdout_truncated': captures['stdout'].truncated,
+            'stderr_truncated': captures['stderr'].truncated,
+            'usage': usage,
+            'oom_killed': oom_killed,
+            'shard_report': shard_report
+        }
+    
+    def _record_usage(self, language: str, tenant: Optional[str], limits: ResourceLimits, result: Dict, sharded: bool = False) -> None:
+        """Feed a finished run's usage into metrics and the limit policy, and report the limits applied."""
+        usage = result['usage']
+        result['limits'] = {
+            'memory_mb': limits.memory_mb,
+            'cpus': limits.cpus,
+            'pids': limits.pids,
+            'timeout_seconds': limits.timeout
+        }
+        if result['error'] == 'cancelled' or sharded:
+            # Sharded runs use several processes' worth of resources, which would skew single-run limits
+            return
+        
+        for key, value in usage.items():
+            if value is not None:
+                metrics.observe(f"sandbox.usage.{key}.{language}", value)
+        
+        hit_limit = result['error'] == 'timeout' or result['oom_killed']
+        self.limit_policy.record(language, tenant, UsageSample(**usage), hit_limit=hit_limit)
+    
+    def _extract_report(self, stderr: str, marker: str) -> Tuple[str, Optional[Dict], int]:
+        """
+        Split a report line printed by runner.py off the end of stderr.
+        
+        Args:
+            stderr: Captured stderr of the container
+            marker: Prefix identifying the report line
+            
+        Returns:
+            Tuple of (stderr without the report line, parsed report or None, bytes removed)
+        """
+        body, _, last_line = stderr.rstrip('\n').rpartition('\n')
+        if not last_line.startswith(marker):
+            return stderr, None, 0
+        
+        report = None
+        try:
+            report = json.loads(last_line[len(marker):])
+            if not isinstance(report, dict):
+                raise ValueError(marker)
+        except ValueError:
+            logger.warning(f"Ignoring malformed sandbox report: {marker}")
+            report = None
+        return (f"{body}\n" if body else ''), report, len(last_line.encode()) + 1
     
-    def execute(self, bundle: CodeBundle) -> Dict[str, str | int | None]:
+    def _plan_shards(self, entry_point: CodeFile, shards: int, temp_path: Path) -> List[List[str]]:
+        """
+        Split the entry point's tests into shards and write the plan for runner.py.
+        
+        Args:
+            entry_point: The test file
+            shards: Shards requested
+            temp_path: Directory mounted at /code
+            
+        Returns:
+            Node ids per shard; empty if the file cannot be sharded or has too few tests
+        """
+        shards = usable_shards(entry_point, shards)
+        if shards < 2:
+            return []
+        
+        plan = plan_shards(collect_tests(entry_point.content), shards, self.duration_history)
+        with open(temp_path / SHARD_PLAN_FILE, 'w') as f:
+            json.dump({'shards': plan}, f)
+        return plan
+    
+    def _record_durations(self, entry_point: CodeFile, shard_report: Dict) -> None:
+        """Remember per-test durations reported by a sharded run."""
+        durations = shard_report.get('durations')
+        if not isinstance(durations, dict):
+            return
+        source_hashes = {test.node_id: test.source_hash for test in collect_tests(entry_point.content) or []}
+        for node_id, seconds in durations.items():
+            if node_id in source_hashes and isinstance(seconds, (int, float)):
+                self.duration_history.record(source_hashes[node_id], float(seconds))
+    
+    def execute(
+        self,
+        bundle: CodeBundle,
+        cancel_event: Optional[threading.Event] = None,
+        tenant: Optional[str] = None,
+        shards: int = 1
+    ) -> Dict:
         """
         Execute code bundle in a Docker or Finch container.
         
         Args:
             bundle: The code bundle to execute
+            cancel_event: Set by the caller to stop the container early
+            tenant: Tenant the run is charged to, used to size adaptive limits
+            shards: Worker processes to split the entry point's tests across; files
+                with fewer tests than this use fewer shards, and a single test is not sharded
             
         Returns:
             Dictionary containing execution results
@@ -137,10 +430,17 @@ class DockerSandboxExecutor(SandboxExecutor):
                 # Write all files to the temporary directory
                 for file in bundle.files.values():
                     file_path = temp_path / file.name
+                    if not file_path.resolve().is_relative_to(temp_path.resolve()):
+                        return {
+                            'stdout': '',
+                            'stderr': f'Invalid file name: {file.name!r}',
+                            'exit_code': -1,
+                            'error': 'validation_error'
+                        }
                     file_path.parent.mkdir(parents=True, exist_ok=True)
                     with open(file_path, 'w') as f:
                         f.write(file.content)
-                    logger.info(f"Wrote file {file.name} with content:\n{file.content}")
+                    log_event(logger, logging.DEBUG, "sandbox.files", "Wrote bundle file", file=file.name, payloads={"content": file.content})
                 
                 # Get entry point file
                 entry_point = bundle.get_entry_point()
@@ -152,61 +452,87 @@ class DockerSandboxExecutor(SandboxExecutor):
                         'error': 'no_entry_point'
                     }
                 
-                # Build container command
-                if self.use_finch:
-                    container_cmd = [
-                        self.container_command, 'run',
-                        '--rm',  # Remove container after execution
-                        '--network=none',  # No network access
-                        '--memory=100m',  # Memory limit
-                        '--cpus=0.5',  # CPU limit
-                        '--pids-limit=50',  # Process limit
-                        '-v', f'{temp_dir}:/code:ro',  # Mount code directory read-only
-                        f'python-sandbox:{entry_point.language}',  # Use language-specific image
-                        '--entrypoint', f'/code/{entry_point.name}'  # Pass the entry point file as argument
-                    ]
-                else:
-                    container_cmd = [
-                        '/usr/local/bin/docker', 'run',
-                        '--rm',  # Remove container after execution
-                        '--network=none',  # No network access
-                        '--memory=100m',  # Memory limit
-                        '--cpus=0.5',  # CPU limit
-                        '--pids-limit=50',  # Process limit
-                        '-v', f'{temp_dir}:/code:ro',  # Mount code directory read-only
-                        f'python-sandbox:{entry_point.language}',  # Use language-specific image
-                        '--entrypoint', f'/code/{entry_point.name}'  # Pass the entry point file as argument
-                    ]
-                
-                logger.info(f"Executing {self.container_command.capitalize()} command: {' '.join(container_cmd)}")
-                
-                # Execute in container
-                process = subprocess.Popen(
-                    container_cmd,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                    text=True,
-                    env=os.environ,  # pass environment variables for Finch
-                )
-                
+                # Bundles with requirements run on a cached derived image
                 try:
-                    stdout, stderr = process.communicate(timeout=self.timeout)
-                    logger.info(f"{self.container_command.capitalize()} execution result - stdout: {stdout}, stderr: {stderr}, exit_code: {process.returncode}")
+                    image = self.layer_cache.resolve(f'python-sandbox:{entry_point.language}', bundle.requirements)
+                except ValueError as e:
                     return {
-                        'stdout': stdout,
-                        'stderr': stderr,
-                        'exit_code': process.returncode,
-                        'error': None
+                        'stdout': '',
+                        'stderr': str(e),
+                        'exit_code': -1,
+                        'error': 'validation_error'
                     }
-                except subprocess.TimeoutExpired:
-                    process.kill()
+                except RuntimeError as e:
                     return {
                         'stdout': '',
-                        'stderr': f'Execution timed out after {self.timeout} seconds',
+                        'stderr': str(e),
                         'exit_code': -1,
-                        'error': 'timeout'
+                        'error': 'dependency_error'
                     }
                 
+                # The layer stays pinned, so it cannot be evicted, until the run is over
+                try:
+                    execution_id = uuid.uuid4().hex
+                    container_name = f"tdd-sandbox-{execution_id}"
+                    
+                    limits = self.limit_policy.limits_for(entry_point.language, tenant)
+                    if self.timeout is not None:
+                        limits = replace(limits, timeout=self.timeout)
+                    
+                    # Large test files run as parallel pytest shards, each getting a single run's resources
+                    plan = self._plan_shards(entry_point, shards, temp_path)
+                    runner_args = ['--entrypoint', f'/code/{entry_point.name}', '--timeout', str(limits.timeout)]
+                    if plan:
+                        limits = replace(
+                            limits,
+                            memory_mb=limits.memory_mb * len(plan),
+                            cpus=round(limits.cpus * len(plan), 2),
+                            pids=limits.pids * len(plan)
+                        )
+                        runner_args += ['--shard-plan', f'/code/{SHARD_PLAN_FILE}']
+                        metrics.observe("sandbox.shards", len(plan))
+                    
+                    # Build container command
+                    if self.use_finch:
+                        container_cmd = [
+                            self.container_command, 'run',
+                            '--rm',  # Remove container after execution
+                            '--name', container_name,  # Lets us stop the container on timeout or cancel
+                            '--network=none',  # No network access
+                            f'--memory={limits.memory_mb}m',  # Memory limit
+                            f'--cpus={limits.cpus}',  # CPU limit
+                            f'--pids-limit={limits.pids}',  # Process limit
+                            '-v', f'{temp_dir}:/code:ro',  # Mount code directory read-only
+                            image,  # Language image, or its dependency layer
+                            *runner_args  # Entry point file, timeout and shard plan for runner.py
+                        ]
+                    else:
+                        container_cmd = [
+                            '/usr/local/bin/docker', 'run',
+                            '--rm',  # Remove container after execution
+                            '--name', container_name,  # Lets us stop the container on timeout or cancel
+                            '--network=none',  # No network access
+                            f'--memory={limits.memory_mb}m',  # Memory limit
+                            f'--cpus={limits.cpus}',  # CPU limit
+                            f'--pids-limit={limits.pids}',  # Process limit
+                            '-v', f'{temp_dir}:/code:ro',  # Mount code directory read-only
+                            image,  # Language image, or its dependency layer
+                            *runner_args  # Entry point file, timeout and shard plan for runner.py
+                        ]
+                    
+                    log_event(logger, logging.INFO, "sandbox.command", "Starting sandbox container", container=container_name, image=image, command=container_cmd)
+                    
+                    result = self._run_container(container_cmd, container_name, execution_id, limits.timeout, cancel_event)
+                    self._record_usage(entry_point.language, tenant, limits, result, sharded=bool(plan))
+                    shard_report = result.pop('shard_report') or {}
+                    if plan:
+                        self._record_durations(entry_point, shard_report)
+                    # No report means runner.py found tests the plan missed and ran the file unsharded
+                    result['shards'] = len(shard_report.get('exit_codes') or []) or 1
+                    return result
+                finally:
+                    self.layer_cache.release(image)
+                
         except Exception as e:
             logger.error(f"Error executing code in {self.container_command.capitalize()}: {str(e)}", exc_info=True)
             return {
@@ -1,5 +1,6 @@
 import logging
-from typing import Dict
+import threading
+from typing import Dict, Optional
 from .base import SandboxExecutor
 from app.models.code_execution import CodeBundle
 
@@ -13,12 +14,21 @@ class FargateSandboxExecutor(SandboxExecutor):
         super().__init__()
         logger.warning("Fargate sandbox executor is not implemented yet")
     
-    def execute(self, bundle: CodeBundle) -> Dict[str, str]:
+    def execute(
+        self,
+        bundle: CodeBundle,
+        cancel_event: Optional[threading.Event] = None,
+        tenant: Optional[str] = None,
+        shards: int = 1
+    ) -> Dict[str, str]:
         """
         Placeholder for Fargate execution.
         
         Args:
             bundle: The code bundle to execute
+            cancel_event: Unused until Fargate execution is implemented
+            tenant: Unused until Fargate execution is implemented
+            shards: Unused until Fargate execution is implemented
             
         Returns:
             Dictionary containing error message
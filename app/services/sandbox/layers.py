@@ -0,0 +1,342 @@
+import os
+import re
+import time
+import shlex
+import hashlib
+import logging
+import threading
+import subprocess
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, List, Optional
+from app.core.config import get_settings
+from app.core.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+LAYER_REPOSITORY = "python-sandbox-deps"
+LAYER_LABEL = "tdd-sandbox.layer"
+BASE_LABEL = "tdd-sandbox.base"
+
+# A project name with optional extras and version specifiers, e.g. "numpy==2.1.0" or "hypothesis[numpy]>=6"
+_VERSION_CLAUSE = r"\s*(==|!=|<=|>=|~=|<|>)\s*[A-Za-z0-9.*+!_-]+"
+REQUIREMENT_PATTERN = re.compile(
+    rf"^(?P<name>[A-Za-z0-9][A-Za-z0-9._-]*)(?P<extras>\[[A-Za-z0-9._,-]+\])?(?P<spec>{_VERSION_CLAUSE}(\s*,{_VERSION_CLAUSE})*)?$"
+)
+
+# A plain "repository:tag" image reference, e.g. "python-sandbox:python-3.12"
+IMAGE_PATTERN = re.compile(r"^[a-z0-9]+(?:[._/-][a-z0-9]+)*:[A-Za-z0-9_][A-Za-z0-9_.-]{0,127}$")
+
+# No "# syntax=" directive: it makes BuildKit pull a frontend image, and builds must work offline
+_DOCKERFILE_TEMPLATE = """FROM {base_image}
+RUN --mount=type=bind,target=/wheelhouse pip install --no-cache-dir --no-index --find-links /wheelhouse {requirements}
+"""
+
+def normalize_requirements(requirements: List[str]) -> List[str]:
+    """
+    Validate and canonicalize a requirements list.
+
+    Names are lower-cased with `_`/`.` folded to `-` and whitespace removed, so
+    equivalent spellings share one cached layer.
+
+    Args:
+        requirements: Requirement strings as submitted by the client
+
+    Returns:
+        Sorted, de-duplicated canonical requirement strings
+
+    Raises:
+        ValueError: If a requirement is not a plain name/version specifier
+    """
+    normalized = set()
+    for requirement in requirements:
+        match = REQUIREMENT_PATTERN.match(requirement.strip())
+        if not match:
+            raise ValueError(f"Invalid requirement: {requirement!r}")
+        name = re.sub(r"[-_.]+", "-", match.group("name")).lower()
+        extras = (match.group("extras") or "").lower()
+        spec = re.sub(r"\s+", "", match.group("spec") or "")
+        normalized.add(f"{name}{extras}{spec}")
+    return sorted(normalized)
+
+def requirements_hash(base_image_id: str, requirements: List[str]) -> str:
+    """
+    Get the cache key for a base image and a normalized requirements list.
+
+    The key uses the base image's ID rather than its tag, so rebuilding the
+    base image (e.g. with a new runner.py) also retires its dependency layers.
+    """
+    digest = hashlib.sha256()
+    digest.update(base_image_id.encode())
+    for requirement in requirements:
+        digest.update(b"\n" + requirement.encode())
+    return digest.hexdigest()[:16]
+
+@dataclass
+class DependencyLayer:
+    """A built, immutable image holding one requirement set on top of a base image."""
+    image: str
+    size_bytes: int
+
+class DependencyLayerCache:
+    """
+    Builds derived sandbox images per requirement set and evicts them LRU by disk budget.
+
+    Packages are installed from a local wheelhouse only (`pip --no-index`), so
+    builds never need network access and the first run with a given set pays the
+    build cost once; later runs reuse the tagged image.
+
+    `resolve` pins the layer it returns until `release` is called, and pinned
+    layers are never evicted, so an image cannot disappear between resolving it
+    and starting a container from it.
+    """
+
+    def __init__(self, container_command: str, wheelhouse_dir: Optional[str], budget_bytes: int, build_timeout: int):
+        """
+        Initialize the dependency layer cache.
+
+        Args:
+            container_command: Path to the docker/finch CLI
+            wheelhouse_dir: Directory of wheels to install from, or None to disable requirements
+            budget_bytes: Total disk allowed for cached layers, excluding their base images
+            build_timeout: Maximum seconds for a single image build
+        """
+        self.container_command = container_command
+        self.wheelhouse_dir = wheelhouse_dir
+        self.budget_bytes = budget_bytes
+        self.build_timeout = build_timeout
+        self._layers: "OrderedDict[str, DependencyLayer]" = OrderedDict()  # Least recently used first
+        self._lock = threading.Lock()
+        self._build_locks: Dict[str, threading.Lock] = {}
+        self._base_sizes: Dict[str, int] = {}
+        self._in_use: Dict[str, int] = {}  # Runs currently holding each layer
+        if self.wheelhouse_dir:
+            self._discover_layers()
+
+    @property
+    def total_bytes(self) -> int:
+        """Disk currently charged to cached layers."""
+        with self._lock:
+            return sum(layer.size_bytes for layer in self._layers.values())
+
+    def resolve(self, base_image: str, requirements: List[str]) -> str:
+        """
+        Get the image to run a bundle with, building its dependency layer if needed.
+
+        Args:
+            base_image: The language image the bundle would otherwise run on
+            requirements: The bundle's third-party requirements
+
+        Returns:
+            The image tag to run; pass it to `release` once the run is over
+
+        Raises:
+            ValueError: If the base image or requirements are invalid, or requirements are not enabled
+            RuntimeError: If the image build fails
+        """
+        # The base image name reaches `docker run` and the layer Dockerfile's FROM line
+        if not IMAGE_PATTERN.match(base_image):
+            raise ValueError(f"Invalid sandbox image: {base_image!r}")
+        requirements = normalize_requirements(requirements)
+        if not requirements:
+            return base_image
+        if not self.wheelhouse_dir:
+            raise ValueError("Third-party requirements are not enabled on this server")
+
+        base_image_id = self._image_id(base_image)
+        if base_image_id is None:
+            raise RuntimeError(f"Sandbox image {base_image} is not available")
+        key = requirements_hash(base_image_id, requirements)
+        if image := self._touch(key):
+            metrics.increment("sandbox.layers.hits")
+            return image
+
+        with self._lock:
+            build_lock = self._build_locks.setdefault(key, threading.Lock())
+
+        # Concurrent requests for the same set wait for a single build
+        with build_lock:
+            if image := self._touch(key):
+                metrics.increment("sandbox.layers.hits")
+                return image
+
+            metrics.increment("sandbox.layers.misses")
+            image = f"{LAYER_REPOSITORY}:{key}"
+            started = time.monotonic()
+            self._build(base_image, base_image_id, image, key, requirements)
+            metrics.observe("sandbox.layers.build_seconds", time.monotonic() - started)
+
+            size = max(self._image_size(image) - self._base_size(base_image_id), 0)
+            with self._lock:
+                self._layers[key] = DependencyLayer(image=image, size_bytes=size)
+                self._in_use[key] = self._in_use.get(key, 0) + 1
+                self._build_locks.pop(key, None)
+            logger.info(f"Built dependency layer {image} ({size} bytes) for {requirements}")
+
+        self._evict(keep=key)
+        return image
+
+    def release(self, image: str) -> None:
+        """
+        Unpin a layer returned by `resolve` once its run is over.
+
+        Args:
+            image: The image tag returned by `resolve`; base images are ignored
+        """
+        key = image[len(LAYER_REPOSITORY) + 1:] if image.startswith(f"{LAYER_REPOSITORY}:") else None
+        with self._lock:
+            if key not in self._in_use:
+                return
+            self._in_use[key] -= 1
+            if self._in_use[key] <= 0:
+                del self._in_use[key]
+        # Layers pinned while the cache was over budget can be evicted now
+        self._evict(keep=None)
+
+    def _touch(self, key: str) -> Optional[str]:
+        """Mark a layer as most recently used, pin it and return its image, if cached."""
+        with self._lock:
+            layer = self._layers.get(key)
+            if layer is None:
+                return None
+            self._layers.move_to_end(key)
+            self._in_use[key] = self._in_use.get(key, 0) + 1
+            return layer.image
+
+    def _evict(self, keep: Optional[str]) -> None:
+        """Remove least recently used, unpinned layers until the cache fits its budget."""
+        skipped = set()
+        while True:
+            with self._lock:
+                total = sum(layer.size_bytes for layer in self._layers.values())
+                if total <= self.budget_bytes:
+                    return
+                victim_key = next(
+                    (k for k in self._layers if k != keep and k not in skipped and k not in self._in_use),
+                    None
+                )
+                if victim_key is None:
+                    return
+                build_lock = self._build_locks.setdefault(victim_key, threading.Lock())
+
+            # Holding the layer's build lock makes concurrent resolves of it wait for the removal
+            with build_lock:
+                with self._lock:
+                    victim = self._layers.get(victim_key)
+                    if victim is None or victim_key in self._in_use:
+                        skipped.add(victim_key)
+                        continue
+                    del self._layers[victim_key]
+
+                result = self._run([self.container_command, 'image', 'rm', victim.image], timeout=60)
+                with self._lock:
+                    if result.returncode != 0:
+                        # Keep charging its disk to the budget, in its old LRU position
+                        self._layers[victim_key] = victim
+                        self._layers.move_to_end(victim_key, last=False)
+                    self._build_locks.pop(victim_key, None)
+
+            if result.returncode != 0:
+                logger.warning(f"Failed to remove dependency layer {victim.image}: {result.stderr.strip()}")
+                metrics.increment("sandbox.layers.eviction_failures")
+                skipped.add(victim_key)
+                continue
+            metrics.increment("sandbox.layers.evictions")
+            metrics.increment("sandbox.layers.evicted_bytes", victim.size_bytes)
+
+    def _build(self, base_image: str, base_image_id: str, image: str, key: str, requirements: List[str]) -> None:
+        """Build a derived image with the requirements installed from the wheelhouse."""
+        dockerfile = _DOCKERFILE_TEMPLATE.format(
+            base_image=base_image,
+            requirements=" ".join(shlex.quote(r) for r in requirements)
+        )
+        try:
+            result = self._run(
+                [
+                    self.container_command, 'build',
+                    '--network=none',  # Wheels come from the wheelhouse only
+                    '--label', f'{LAYER_LABEL}={key}',
+                    '--label', f'{BASE_LABEL}={base_image_id}',
+                    '-t', image,
+                    '-f', '-',  # Dockerfile from stdin
+                    self.wheelhouse_dir  # Build context, bind-mounted during pip install
+                ],
+                timeout=self.build_timeout,
+                input=dockerfile
+            )
+        except subprocess.TimeoutExpired:
+            raise RuntimeError(f"Building dependency layer timed out after {self.build_timeout} seconds")
+        if result.returncode != 0:
+            raise RuntimeError(f"Failed to install requirements: {result.stderr.strip()[-2000:]}")
+
+    def _discover_layers(self) -> None:
+        """Track layers left over from previous runs so they count against the budget."""
+        result = self._run([self.container_command, 'images', '-q', '--filter', f'label={LAYER_LABEL}'], timeout=30)
+        image_ids = sorted(set(result.stdout.split())) if result.returncode == 0 else []
+        if not image_ids:
+            return
+
+        result = self._run(
+            [
+                self.container_command, 'image', 'inspect',
+                '--format', f'{{{{.Created}}}} {{{{index .Config.Labels "{LAYER_LABEL}"}}}} {{{{index .Config.Labels "{BASE_LABEL}"}}}} {{{{.Size}}}}',
+                *image_ids
+            ],
+            timeout=30
+        )
+        if result.returncode != 0:
+            logger.warning(f"Failed to inspect existing dependency layers: {result.stderr.strip()}")
+            return
+
+        # Oldest first approximates LRU order across restarts
+        for line in sorted(result.stdout.splitlines()):
+            try:
+                _, key, base_image_id, size = line.split()
+                size_bytes = max(int(size) - self._base_size(base_image_id), 0)
+            except ValueError:
+                continue
+            self._layers[key] = DependencyLayer(image=f"{LAYER_REPOSITORY}:{key}", size_bytes=size_bytes)
+        logger.info(f"Discovered {len(self._layers)} cached dependency layers")
+
+    def _image_id(self, image: str) -> Optional[str]:
+        """Get the ID of an image, or None if it does not exist."""
+        result = self._run([self.container_command, 'image', 'inspect', '--format', '{{.Id}}', image], timeout=30)
+        image_id = result.stdout.strip()
+        return image_id if result.returncode == 0 and image_id else None
+
+    def _base_size(self, base_image: str) -> int:
+        """Get (and remember) the size of a base image."""
+        if base_image not in self._base_sizes:
+            self._base_sizes[base_image] = self._image_size(base_image)
+        return self._base_sizes[base_image]
+
+    def _image_size(self, image: str) -> int:
+        """Get the size of an image in bytes, or 0 if it cannot be inspected."""
+        result = self._run([self.container_command, 'image', 'inspect', '--format', '{{.Size}}', image], timeout=30)
+        try:
+            return int(result.stdout.strip())
+        except ValueError:
+            return 0
+
+    def _run(self, cmd: List[str], timeout: int, input: Optional[str] = None) -> subprocess.CompletedProcess:
+        """Run a container CLI command."""
+        return subprocess.run(
+            cmd,
+            input=input,
+            capture_output=True,
+            text=True,
+            timeout=timeout,
+            env=os.environ
+        )
+
+@lru_cache()
+def get_layer_cache(container_command: str) -> DependencyLayerCache:
+    """Get the process-wide dependency layer cache for a container CLI."""
+    settings = get_settings()
+    return DependencyLayerCache(
+        container_command=container_command,
+        wheelhouse_dir=settings.SANDBOX_WHEELHOUSE_DIR,
+        budget_bytes=settings.SANDBOX_LAYER_BUDGET_BYTES,
+        build_timeout=settings.SANDBOX_LAYER_BUILD_TIMEOUT
+    )
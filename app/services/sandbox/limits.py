@@ -0,0 +1,191 @@
+import math
+import threading
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Deque, Dict, List, Optional, Tuple
+from app.core.config import get_settings
+from app.core.metrics import metrics
+
+# Exit code of a container whose runner was killed by the OOM killer (128 + SIGKILL);
+# when the runner survives it reports OOM kills of the test process itself
+OOM_EXIT_CODE = 137
+
+@dataclass(frozen=True)
+class ResourceLimits:
+    """Resource limits applied to a single sandbox run."""
+    memory_mb: int
+    cpus: float
+    pids: int
+    timeout: float
+
+@dataclass
+class UsageSample:
+    """Resources one run actually used."""
+    wall_time_seconds: float
+    cpu_time_seconds: Optional[float] = None
+    peak_memory_bytes: Optional[int] = None
+    process_count: Optional[int] = None
+
+def percentile(values: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(fraction * len(ordered)) - 1))]
+
+class AdaptiveLimitPolicy:
+    """
+    Sizes sandbox limits from the recent usage of similar runs.
+
+    Usage is kept per language and, for the most recently seen tenants, per
+    (language, tenant); other tenants fall back to their language. Once a key has enough
+    samples, each limit becomes its usage percentile times a headroom factor,
+    clamped between the configured minimum and the configured (default) limit.
+    Runs that hit a limit are recorded at the ceiling, so limits that turn out
+    too tight grow back quickly.
+    """
+
+    def __init__(
+        self,
+        defaults: ResourceLimits,
+        minimums: ResourceLimits,
+        enabled: bool = True,
+        fraction: float = 0.95,
+        headroom: float = 1.5,
+        min_samples: int = 20,
+        window: int = 200,
+        max_tenant_keys: int = 1000
+    ):
+        """
+        Initialize the policy.
+
+        Args:
+            defaults: Limits used until enough samples exist; also the upper bound
+            minimums: Lower bound for adapted limits
+            enabled: When False, `limits_for` always returns `defaults`
+            fraction: Usage percentile the limits are based on
+            headroom: Multiplier applied to that percentile
+            min_samples: Samples needed before a key's limits are adapted
+            window: Recent samples kept per key
+            max_tenant_keys: (language, tenant) keys kept before the least
+                recently recorded one is dropped
+        """
+        self.defaults = defaults
+        self.minimums = minimums
+        self.enabled = enabled
+        self.fraction = fraction
+        self.headroom = headroom
+        self.min_samples = min_samples
+        self.window = window
+        self.max_tenant_keys = max_tenant_keys
+        self._history: Dict[str, Deque[UsageSample]] = {}
+        self._tenant_history: "OrderedDict[Tuple[str, str], Deque[UsageSample]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def limits_for(self, language: str, tenant: Optional[str] = None) -> ResourceLimits:
+        """
+        Get the limits for a run.
+
+        Args:
+            language: Language of the bundle's entry point
+            tenant: Tenant the run is charged to, if known
+
+        Returns:
+            Limits based on the tenant's history, else the language's, else the defaults
+        """
+        if not self.enabled:
+            return self.defaults
+        with self._lock:
+            for samples in (self._tenant_history.get((language, tenant)), self._history.get(language)):
+                if samples is not None and len(samples) >= self.min_samples:
+                    return self._from_samples(list(samples))
+        return self.defaults
+
+    def record(self, language: str, tenant: Optional[str], usage: UsageSample, hit_limit: bool = False) -> None:
+        """
+        Record what a run used.
+
+        Args:
+            language: Language of the bundle's entry point
+            tenant: Tenant the run is charged to, if known
+            usage: Measured usage of the run
+            hit_limit: Whether the run timed out or was killed for memory
+        """
+        if not self.enabled:
+            return
+        if hit_limit:
+            # The run needed more than it got: pull future limits up to the ceiling
+            usage = UsageSample(
+                wall_time_seconds=self.defaults.timeout,
+                cpu_time_seconds=self.defaults.cpus * self.defaults.timeout,
+                peak_memory_bytes=self.defaults.memory_mb * 1024 ** 2,
+                process_count=self.defaults.pids
+            )
+            metrics.increment("sandbox.limits.hit")
+        with self._lock:
+            samples = self._history.get(language)
+            if samples is None:
+                samples = self._history[language] = deque(maxlen=self.window)
+            samples.append(usage)
+            if tenant is None:
+                return
+            key = (language, tenant)
+            samples = self._tenant_history.get(key)
+            if samples is None:
+                samples = self._tenant_history[key] = deque(maxlen=self.window)
+                if len(self._tenant_history) > self.max_tenant_keys:
+                    self._tenant_history.popitem(last=False)
+            else:
+                self._tenant_history.move_to_end(key)
+            samples.append(usage)
+
+    def _from_samples(self, samples: List[UsageSample]) -> ResourceLimits:
+        """Derive limits from usage samples."""
+        def sized(values: List[float], minimum: float, maximum: float) -> float:
+            if not values:
+                return maximum
+            return min(maximum, max(minimum, percentile(values, self.fraction) * self.headroom))
+
+        memory_mb = sized(
+            [s.peak_memory_bytes / 1024 ** 2 for s in samples if s.peak_memory_bytes is not None],
+            self.minimums.memory_mb, self.defaults.memory_mb
+        )
+        cpus = sized(
+            [s.cpu_time_seconds / s.wall_time_seconds for s in samples if s.cpu_time_seconds is not None and s.wall_time_seconds > 0],
+            self.minimums.cpus, self.defaults.cpus
+        )
+        pids = sized(
+            [s.process_count for s in samples if s.process_count is not None],
+            self.minimums.pids, self.defaults.pids
+        )
+        timeout = sized([s.wall_time_seconds for s in samples], self.minimums.timeout, self.defaults.timeout)
+        return ResourceLimits(
+            memory_mb=math.ceil(memory_mb),
+            cpus=round(cpus, 2),
+            pids=math.ceil(pids),
+            timeout=round(timeout, 1)
+        )
+
+@lru_cache()
+def get_limit_policy() -> AdaptiveLimitPolicy:
+    """Get the process-wide limit policy."""
+    settings = get_settings()
+    return AdaptiveLimitPolicy(
+        defaults=ResourceLimits(
+            memory_mb=settings.SANDBOX_MEMORY_MB,
+            cpus=settings.SANDBOX_CPUS,
+            pids=settings.SANDBOX_PIDS_LIMIT,
+            timeout=settings.SANDBOX_TIMEOUT_SECONDS
+        ),
+        minimums=ResourceLimits(
+            memory_mb=settings.SANDBOX_MIN_MEMORY_MB,
+            cpus=settings.SANDBOX_MIN_CPUS,
+            pids=settings.SANDBOX_MIN_PIDS_LIMIT,
+            timeout=settings.SANDBOX_MIN_TIMEOUT_SECONDS
+        ),
+        enabled=settings.SANDBOX_ADAPTIVE_LIMITS,
+        fraction=settings.SANDBOX_ADAPTIVE_PERCENTILE,
+        headroom=settings.SANDBOX_ADAPTIVE_HEADROOM,
+        min_samples=settings.SANDBOX_ADAPTIVE_MIN_SAMPLES,
+        window=settings.SANDBOX_ADAPTIVE_WINDOW,
+        max_tenant_keys=settings.SANDBOX_ADAPTIVE_MAX_TENANT_KEYS
+    )
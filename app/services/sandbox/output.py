@@ -0,0 +1,196 @@
+import os
+import re
+import shutil
+import logging
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from pathlib import Path
+from typing import BinaryIO, Dict, Optional
+from app.core.config import get_settings
+from app.core.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+READ_CHUNK_SIZE = 64 * 1024
+EXECUTION_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+STREAMS = ("stdout", "stderr")
+
+class BoundedCapture:
+    """
+    Captures a stream keeping only its first and last bytes in memory.
+
+    Everything in between is counted and, if a spill file is given, written to
+    disk up to `spill_limit` bytes, so a run that prints in a loop cannot grow
+    API worker memory beyond head + tail.
+    """
+
+    def __init__(self, head_bytes: int, tail_bytes: int, spill: Optional[BinaryIO] = None, spill_limit: int = 0):
+        """
+        Initialize the capture.
+
+        Args:
+            head_bytes: Bytes kept from the start of the stream
+            tail_bytes: Bytes kept from the end of the stream
+            spill: Optional file receiving the full stream
+            spill_limit: Maximum bytes written to `spill`
+        """
+        self.head_bytes = head_bytes
+        self.tail_bytes = tail_bytes
+        self.spill = spill
+        self.spill_limit = spill_limit
+        self.total_bytes = 0
+        self.spilled_bytes = 0
+        self._head = bytearray()
+        self._tail = bytearray()
+
+    @property
+    def truncated(self) -> bool:
+        """Whether some of the stream is missing from `text()`."""
+        return self.total_bytes > len(self._head) + len(self._tail)
+
+    def feed(self, data: bytes) -> None:
+        """Add the next chunk of the stream."""
+        self.total_bytes += len(data)
+        if self.spill is not None and self.spilled_bytes < self.spill_limit:
+            part = data[:self.spill_limit - self.spilled_bytes]
+            try:
+                self.spill.write(part)
+                self.spilled_bytes += len(part)
+            except OSError as e:
+                # Keep draining the pipe even if the disk is full
+                logger.warning(f"Stopped spilling sandbox output: {str(e)}")
+                self.spill = None
+
+        if len(self._head) < self.head_bytes:
+            room = self.head_bytes - len(self._head)
+            self._head += data[:room]
+            data = data[room:]
+        if data and self.tail_bytes > 0:
+            self._tail += data[-self.tail_bytes:]
+            del self._tail[:-self.tail_bytes]
+
+    def text(self) -> str:
+        """Get the captured output, with a marker where bytes were dropped."""
+        head = self._head.decode(errors="replace")
+        if not self.truncated:
+            return head + self._tail.decode(errors="replace")
+        omitted = self.total_bytes - len(self._head) - len(self._tail)
+        return f"{head}\n... [{omitted} bytes truncated] ...\n{self._tail.decode(errors='replace')}"
+
+    def drain(self, pipe: BinaryIO) -> None:
+        """Read `pipe` to EOF into the capture; meant to run on its own thread."""
+        fd = pipe.fileno()
+        while chunk := os.read(fd, READ_CHUNK_SIZE):
+            self.feed(chunk)
+
+class OutputStore:
+    """
+    Size-capped local store of full sandbox output, fetched by execution id.
+
+    Each execution gets a directory holding one file per stream. The size of
+    every stored execution is kept in memory, oldest first, so staying within
+    the budget costs a few stats per run rather than a scan of the store.
+    """
+
+    def __init__(self, directory: str, max_bytes_per_stream: int, budget_bytes: int):
+        """
+        Initialize the output store.
+
+        Args:
+            directory: Where spilled output is kept
+            max_bytes_per_stream: Cap on each stored stdout/stderr file
+            budget_bytes: Total disk allowed for the store
+        """
+        self.directory = Path(directory)
+        self.max_bytes_per_stream = max_bytes_per_stream
+        self.budget_bytes = budget_bytes
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._sizes: "OrderedDict[str, int]" = OrderedDict()  # Execution id to bytes stored, oldest first
+        self._total_bytes = 0
+        self._index_existing()
+
+    @property
+    def total_bytes(self) -> int:
+        """Bytes currently stored."""
+        return self._total_bytes
+
+    def open(self, execution_id: str, stream: str) -> BinaryIO:
+        """Open the file receiving one stream of an execution."""
+        path = self._path(execution_id, stream)
+        path.parent.mkdir(exist_ok=True)
+        return open(path, "wb")
+
+    def get(self, execution_id: str, stream: str) -> Optional[Path]:
+        """Get the stored output file, or None if unknown or evicted."""
+        if not EXECUTION_ID_PATTERN.match(execution_id) or stream not in STREAMS:
+            return None
+        path = self._path(execution_id, stream)
+        return path if path.is_file() else None
+
+    def finish(self, execution_id: str, max_bytes: Optional[Dict[str, int]] = None) -> None:
+        """
+        Record a finished execution's output, then enforce the budget.
+
+        Args:
+            execution_id: The execution whose files are complete
+            max_bytes: Per-stream sizes to cut files down to, e.g. to drop the
+                runner's report lines from the end of stderr
+        """
+        size = 0
+        for stream in STREAMS:
+            path = self._path(execution_id, stream)
+            try:
+                if max_bytes and stream in max_bytes and path.stat().st_size > max_bytes[stream]:
+                    os.truncate(path, max_bytes[stream])
+                size += path.stat().st_size
+            except OSError:
+                continue
+        if size == 0:
+            shutil.rmtree(self.directory / execution_id, ignore_errors=True)
+            return
+
+        with self._lock:
+            self._sizes[execution_id] = size
+            self._total_bytes += size
+        self.enforce_budget()
+
+    def enforce_budget(self) -> None:
+        """Remove the oldest executions until the store fits its budget."""
+        while True:
+            with self._lock:
+                if self._total_bytes <= self.budget_bytes or not self._sizes:
+                    return
+                execution_id, size = self._sizes.popitem(last=False)
+                self._total_bytes -= size
+            shutil.rmtree(self.directory / execution_id, ignore_errors=True)
+            metrics.increment("sandbox.output_store.evicted_runs")
+
+    def _index_existing(self) -> None:
+        """Index executions left over from previous runs, oldest first."""
+        runs = []
+        for run_dir in self.directory.iterdir():
+            try:
+                runs.append((run_dir.stat().st_mtime, sum(f.stat().st_size for f in run_dir.iterdir()), run_dir.name))
+            except OSError:
+                continue
+        for _, size, execution_id in sorted(runs):
+            self._sizes[execution_id] = size
+            self._total_bytes += size
+        self.enforce_budget()
+
+    def _path(self, execution_id: str, stream: str) -> Path:
+        return self.directory / execution_id / f"{stream}.log"
+
+@lru_cache()
+def get_output_store() -> Optional[OutputStore]:
+    """Get the process-wide output store, or None if spilling is disabled."""
+    settings = get_settings()
+    if not settings.SANDBOX_OUTPUT_SPILL_DIR:
+        return None
+    return OutputStore(
+        directory=settings.SANDBOX_OUTPUT_SPILL_DIR,
+        max_bytes_per_stream=settings.SANDBOX_OUTPUT_SPILL_MAX_BYTES,
+        budget_bytes=settings.SANDBOX_OUTPUT_SPILL_BUDGET_BYTES
+    )
@@ -0,0 +1,329 @@
+import time
+import heapq
+import asyncio
+import logging
+import itertools
+from dataclasses import dataclass
+from enum import Enum
+from functools import lru_cache
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple, TypeVar
+from app.core.config import get_settings
+from app.core.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Metric label for tenants beyond the per-tenant metrics cap
+OTHER_TENANTS = "_other"
+# Prefix of tenant ids derived from an API key; only these can be given weights
+KEYED_TENANT_PREFIX = "key-"
+
+class Priority(str, Enum):
+    """Priority classes; every queued interactive job is dispatched before any batch job."""
+    INTERACTIVE = "interactive"
+    BATCH = "batch"
+
+_PRIORITY_RANK = {Priority.INTERACTIVE: 0, Priority.BATCH: 1}
+
+class SchedulerRejected(Exception):
+    """Raised when a job is refused by rate limiting or admission control."""
+
+    def __init__(self, reason: str, retry_after: Optional[float] = None):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, holding at most `capacity`."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def try_acquire(self) -> Tuple[bool, float]:
+        """
+        Take one token if available.
+
+        Returns:
+            Tuple of (acquired, seconds until a token is available)
+        """
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True, 0.0
+        return False, (1 - self.tokens) / self.rate if self.rate > 0 else float("inf")
+
+    def is_full(self, now: float) -> bool:
+        """Whether the bucket has refilled completely, making it the same as a new one."""
+        return self.tokens + (now - self.updated) * self.rate >= self.capacity
+
+@dataclass
+class _Job:
+    """A queued job waiting for a sandbox slot."""
+    tenant: str
+    priority: Priority
+    enqueued_at: float
+    ready: asyncio.Future
+    slots: int = 1
+    withdrawn: bool = False
+
+class SandboxScheduler:
+    """
+    Admits sandbox jobs per tenant and dispatches them by weighted fair queuing.
+
+    Each tenant's jobs get virtual finish tags advancing by slots/weight, so under
+    contention tenants receive slots in proportion to their weights regardless of
+    how many jobs each one submits. A job needing several slots (a sharded test run)
+    waits at the head of its queue until that many are free. Interactive jobs
+    always go before batch jobs.
+    All bookkeeping happens on the event loop, so no locking is needed.
+
+    Tenant ids come from unauthenticated headers, so per-tenant state of idle
+    tenants is swept periodically and per-tenant metrics are capped.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int,
+        max_queue_depth: int,
+        max_tenant_queue_depth: int,
+        batch_queue_ratio: float,
+        tenant_rate: float,
+        tenant_burst: int,
+        tenant_weights: Optional[Dict[str, float]] = None,
+        idle_sweep_interval: float = 60.0,
+        max_metric_tenants: int = 50
+    ):
+        """
+        Initialize the scheduler.
+
+        Args:
+            max_concurrency: Jobs allowed to run at once
+            max_queue_depth: Waiting jobs across all tenants before new jobs are rejected
+            max_tenant_queue_depth: Waiting jobs per tenant before that tenant is rejected
+            batch_queue_ratio: Fraction of max_queue_depth after which batch jobs are rejected
+            tenant_rate: Sustained jobs per second allowed per tenant
+            tenant_burst: Token bucket capacity per tenant
+            tenant_weights: Fair-share weight per tenant id (default 1.0)
+            idle_sweep_interval: Seconds between sweeps of idle tenants' state
+            max_metric_tenants: Tenants, besides those in tenant_weights, that get their
+                own wait time metrics; later ones are reported together
+        """
+        self.max_concurrency = max_concurrency
+        self.max_queue_depth = max_queue_depth
+        self.max_tenant_queue_depth = max_tenant_queue_depth
+        self.batch_queue_ratio = batch_queue_ratio
+        self.tenant_rate = tenant_rate
+        self.tenant_burst = tenant_burst
+        self.tenant_weights = tenant_weights or {}
+        self.idle_sweep_interval = idle_sweep_interval
+        self.max_metric_tenants = max_metric_tenants
+
+        self._heap: List[Tuple[int, float, int, _Job]] = []
+        self._sequence = itertools.count()
+        self._virtual_time = 0.0
+        self._last_finish: Dict[str, float] = {}
+        self._queued_per_tenant: Dict[str, int] = {}
+        self._queued = 0
+        self._running = 0
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._last_sweep = time.monotonic()
+        self._metric_tenants: Set[str] = set()
+
+    @property
+    def queue_depth(self) -> int:
+        """Number of jobs waiting for a slot."""
+        return self._queued
+
+    @property
+    def running(self) -> int:
+        """Number of slots currently held by running jobs."""
+        return self._running
+
+    async def run(
+        self,
+        job: Callable[[], Awaitable[T]],
+        tenant: str,
+        priority: Priority = Priority.INTERACTIVE,
+        slots: int = 1
+    ) -> T:
+        """
+        Wait for a fair-share slot, then run `job` in it.
+
+        If the caller is cancelled while queued, the job is withdrawn. If it is
+        cancelled while running, the slot is held until `job` actually finishes, so
+        capacity is never over-committed while a container is being torn down.
+
+        Args:
+            job: Coroutine factory doing the sandbox work
+            tenant: Tenant id the job is charged to
+            priority: Priority class of the job
+            slots: Slots the job occupies, capped at max_concurrency
+
+        Returns:
+            Whatever `job` returns
+
+        Raises:
+            SchedulerRejected: If the tenant is rate limited or the queue is full
+        """
+        entry = self._admit(tenant, priority, max(1, min(slots, self.max_concurrency)))
+        try:
+            await entry.ready
+        except asyncio.CancelledError:
+            if entry.ready.done() and not entry.ready.cancelled():
+                # Dispatched in the same tick we were cancelled; give the slot back
+                self._release(entry.slots)
+            else:
+                self._withdraw(entry)
+            raise
+
+        wait = time.monotonic() - entry.enqueued_at
+        metrics.observe(f"sandbox.scheduler.wait_seconds.{self._metric_tenant(tenant)}", wait)
+        metrics.observe(f"sandbox.scheduler.wait_seconds.{priority.value}", wait)
+
+        task = asyncio.ensure_future(job())
+        task.add_done_callback(lambda done: self._job_done(done, entry.slots))
+        return await asyncio.shield(task)
+
+    def _admit(self, tenant: str, priority: Priority, slots: int) -> _Job:
+        """Apply rate limits and admission control, then enqueue the job."""
+        self._sweep_idle()
+        bucket = self._buckets.get(tenant)
+        if bucket is None:
+            bucket = self._buckets[tenant] = TokenBucket(self.tenant_rate, self.tenant_burst)
+        acquired, retry_after = bucket.try_acquire()
+        if not acquired:
+            metrics.increment("sandbox.scheduler.rejected.rate_limited")
+            raise SchedulerRejected("Rate limit exceeded", retry_after=retry_after)
+
+        if self._queued_per_tenant.get(tenant, 0) >= self.max_tenant_queue_depth:
+            metrics.increment("sandbox.scheduler.rejected.tenant_queue_full")
+            raise SchedulerRejected("Too many queued jobs for this tenant")
+
+        queue_limit = self.max_queue_depth
+        if priority == Priority.BATCH:
+            queue_limit = int(self.max_queue_depth * self.batch_queue_ratio)
+        if self._queued >= queue_limit:
+            metrics.increment(f"sandbox.scheduler.rejected.queue_full.{priority.value}")
+            raise SchedulerRejected("Sandbox queue is full")
+
+        weight = self.tenant_weights.get(tenant, 1.0)
+        start = max(self._virtual_time, self._last_finish.get(tenant, 0.0))
+        finish = start + slots / weight
+        self._last_finish[tenant] = finish
+
+        entry = _Job(
+            tenant=tenant,
+            priority=priority,
+            enqueued_at=time.monotonic(),
+            ready=asyncio.get_running_loop().create_future(),
+            slots=slots
+        )
+        heapq.heappush(self._heap, (_PRIORITY_RANK[priority], finish, next(self._sequence), entry))
+        self._queued += 1
+        self._queued_per_tenant[tenant] = self._queued_per_tenant.get(tenant, 0) + 1
+        metrics.increment("sandbox.scheduler.admitted")
+
+        self._dispatch()
+        return entry
+
+    def _sweep_idle(self) -> None:
+        """Forget the state of tenants with nothing queued; new tenants start from the same state."""
+        now = time.monotonic()
+        if now - self._last_sweep < self.idle_sweep_interval:
+            return
+        self._last_sweep = now
+        for tenant in [t for t, bucket in self._buckets.items() if bucket.is_full(now)]:
+            del self._buckets[tenant]
+        for tenant in [t for t in self._last_finish if t not in self._queued_per_tenant]:
+            del self._last_finish[tenant]
+
+    def _metric_tenant(self, tenant: str) -> str:
+        """Get the tenant label for metrics, bounding how many distinct labels exist."""
+        if tenant in self.tenant_weights or tenant in self._metric_tenants:
+            return tenant
+        if len(self._metric_tenants) < self.max_metric_tenants:
+            self._metric_tenants.add(tenant)
+            return tenant
+        return OTHER_TENANTS
+
+    def _withdraw(self, entry: _Job) -> None:
+        """Drop a queued job whose caller went away; the heap entry is skipped lazily."""
+        if entry.withdrawn:
+            return
+        entry.withdrawn = True
+        self._dequeued(entry.tenant)
+        metrics.increment("sandbox.scheduler.withdrawn")
+        self._update_gauges()
+
+    def _job_done(self, task: asyncio.Future, slots: int) -> None:
+        """Release the slots once the job has really finished, even if its caller left."""
+        if not task.cancelled():
+            task.exception()  # Mark as retrieved when nobody is awaiting it any more
+        self._release(slots)
+
+    def _release(self, slots: int) -> None:
+        """Free running slots and hand them to the next jobs."""
+        self._running -= slots
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        """Start queued jobs in order while enough slots are free for the next one."""
+        while self._heap:
+            _, finish, _, entry = self._heap[0]
+            if entry.withdrawn or entry.ready.done():
+                # Cancelled callers whose except handler has not run yet are withdrawn there
+                heapq.heappop(self._heap)
+                continue
+            if self._running + entry.slots > self.max_concurrency:
+                # Not skipped for smaller jobs, which could otherwise starve it forever
+                break
+            heapq.heappop(self._heap)
+            self._virtual_time = max(self._virtual_time, finish)
+            self._dequeued(entry.tenant)
+            entry.withdrawn = True  # No longer queued; later cancellation releases the slots instead
+            entry.ready.set_result(None)
+            self._running += entry.slots
+        self._update_gauges()
+
+    def _dequeued(self, tenant: str) -> None:
+        """Update queue counters after a job leaves the queue."""
+        self._queued -= 1
+        remaining = self._queued_per_tenant[tenant] - 1
+        if remaining:
+            self._queued_per_tenant[tenant] = remaining
+        else:
+            del self._queued_per_tenant[tenant]
+            # Idle tenants are restarted at the current virtual time anyway
+            if self._last_finish.get(tenant, 0.0) <= self._virtual_time:
+                self._last_finish.pop(tenant, None)
+
+    def _update_gauges(self) -> None:
+        metrics.set_gauge("sandbox.scheduler.queue_depth", self._queued)
+        metrics.set_gauge("sandbox.scheduler.running", self._running)
+
+@lru_cache()
+def get_scheduler() -> SandboxScheduler:
+    """Get the process-wide sandbox scheduler."""
+    settings = get_settings()
+    # Other tenant ids come from headers anyone can send, so they never get a configured weight
+    tenant_weights = {
+        tenant: weight for tenant, weight in settings.SANDBOX_TENANT_WEIGHTS.items()
+        if tenant.startswith(KEYED_TENANT_PREFIX)
+    }
+    if len(tenant_weights) < len(settings.SANDBOX_TENANT_WEIGHTS):
+        logger.warning(f"Ignoring SANDBOX_TENANT_WEIGHTS entries not starting with {KEYED_TENANT_PREFIX!r}")
+    return SandboxScheduler(
+        max_concurrency=settings.SANDBOX_MAX_CONCURRENCY,
+        max_queue_depth=settings.SANDBOX_MAX_QUEUE_DEPTH,
+        max_tenant_queue_depth=settings.SANDBOX_MAX_TENANT_QUEUE_DEPTH,
+        batch_queue_ratio=settings.SANDBOX_BATCH_QUEUE_RATIO,
+        tenant_rate=settings.SANDBOX_TENANT_RATE,
+        tenant_burst=settings.SANDBOX_TENANT_BURST,
+        tenant_weights=tenant_weights
+    )
@@ -0,0 +1,223 @@
+import ast
+import heapq
+import hashlib
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import List, Optional
+from app.models.code_execution import CodeFile
+
+# Name of the plan file written next to the bundle files for runner.py
+SHARD_PLAN_FILE = ".sandbox_shard_plan.json"
+
+@dataclass
+class CollectedTest:
+    """A test found in a test file, identified the way pytest names it."""
+    node_id: str  # e.g. "test_add" or "TestMath::test_add"
+    source_hash: str  # Hash of the test's source, so history follows the test across edits
+
+# `python test.py` only runs tests if its main block hands them to one of these
+_RUNNER_CALLS = {("unittest", "main"), ("pytest", "main")}
+# unittest.main() keywords that do not change which tests run or their outcome
+_UNITTEST_MAIN_KEYWORDS = {"verbosity", "exit", "buffer", "warnings"}
+# pytest.main() flags that do not change which tests run or their outcome
+_PYTEST_MAIN_FLAGS = {"-q", "-v", "-vv", "-s", "--quiet", "--verbose"}
+
+def _test_runner(node: ast.stmt) -> Optional[str]:
+    """Get the runner a top-level `if __name__ == "__main__":` block hands all tests to, if that is all it does."""
+    test = node.test if isinstance(node, ast.If) else None
+    if not (
+        isinstance(test, ast.Compare)
+        and isinstance(test.left, ast.Name) and test.left.id == "__name__"
+        and len(test.comparators) == 1
+        and isinstance(test.comparators[0], ast.Constant) and test.comparators[0].value == "__main__"
+    ):
+        return None
+    body = [stmt for stmt in node.body if not isinstance(stmt, (ast.Import, ast.ImportFrom))]
+    if node.orelse or len(body) != 1 or not isinstance(body[0], ast.Expr):
+        return None
+
+    call = body[0].value
+    if isinstance(call, ast.Call) and isinstance(call.func, ast.Name) and call.func.id == "exit" and len(call.args) == 1:
+        call = call.args[0]  # sys.exit(pytest.main()) style, via `from sys import exit`
+    if isinstance(call, ast.Call) and isinstance(call.func, ast.Attribute) and call.func.attr == "exit" and len(call.args) == 1:
+        call = call.args[0]  # sys.exit(pytest.main())
+    if not (isinstance(call, ast.Call) and isinstance(call.func, ast.Attribute) and isinstance(call.func.value, ast.Name)):
+        return None
+    runner = (call.func.value.id, call.func.attr)
+    if runner not in _RUNNER_CALLS:
+        return None
+
+    if runner[0] == "unittest":
+        if call.args or any(k.arg not in _UNITTEST_MAIN_KEYWORDS for k in call.keywords):
+            return None
+        return "unittest"
+    if call.keywords or len(call.args) > 1:
+        return None
+    if call.args:
+        args = call.args[0]
+        if not isinstance(args, ast.List) or not all(
+            (isinstance(a, ast.Name) and a.id == "__file__") or (isinstance(a, ast.Constant) and a.value in _PYTEST_MAIN_FLAGS)
+            for a in args.elts
+        ):
+            return None
+    return "pytest"
+
+def _is_test_case(node: ast.ClassDef) -> bool:
+    return any(
+        (isinstance(base, ast.Name) and base.id == "TestCase") or (isinstance(base, ast.Attribute) and base.attr == "TestCase")
+        for base in node.bases
+    )
+
+def collect_tests(source: str) -> Optional[List[CollectedTest]]:
+    """
+    Find the tests of a test file without running it, if it can be sharded safely.
+
+    Bundles run as `python test.py`, which only runs tests when the file's
+    `__main__` block hands them to `unittest.main()` or `pytest.main()`. Shards
+    run their tests with pytest, so a file is only shardable when that gives
+    the same tests: its main block is one of those calls, and every test can be
+    named from the source alone. Dynamically created tests, inherited test
+    methods, and tests pytest would run but unittest would not all make the
+    file unshardable.
+
+    Args:
+        source: Content of the test file
+
+    Returns:
+        Collected tests, in file order, or None if the file cannot be sharded
+    """
+    try:
+        tree = ast.parse(source)
+    except SyntaxError:
+        return None
+
+    def collected(node: ast.AST, node_id: str) -> CollectedTest:
+        segment = ast.get_source_segment(source, node) or node_id
+        return CollectedTest(node_id=node_id, source_hash=hashlib.sha256(segment.encode()).hexdigest()[:16])
+
+    def defines_tests(targets: List[ast.expr]) -> bool:
+        return any(not isinstance(t, ast.Name) or t.id.lower().startswith("test") for t in targets)
+
+    runners = [runner for node in tree.body if (runner := _test_runner(node))]
+    if len(runners) != 1:
+        return None
+    runner = runners[0]
+
+    tests = []
+    for node in tree.body:
+        if isinstance(node, (ast.Import, ast.ImportFrom)) or _test_runner(node):
+            continue
+        if isinstance(node, ast.Expr) and isinstance(node.value, ast.Constant):
+            continue  # Docstring
+        if isinstance(node, ast.Assign) and not defines_tests(node.targets):
+            continue
+        if isinstance(node, ast.AnnAssign) and not defines_tests([node.target]):
+            continue
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            if node.name.startswith("test"):
+                if runner == "unittest":
+                    return None  # unittest would not run it
+                tests.append(collected(node, node.name))
+            continue
+        if isinstance(node, ast.ClassDef):
+            test_case = _is_test_case(node)
+            if not (test_case or (runner == "pytest" and node.name.startswith("Test"))):
+                if runner == "unittest" and node.name.startswith("Test"):
+                    return None  # pytest would run it, unittest would not
+                continue
+            if len(node.bases) != int(test_case) or node.keywords:
+                return None  # Inherited tests cannot be named from this file
+            for item in node.body:
+                if isinstance(item, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                    if item.name == "__init__" and not test_case:
+                        return None  # pytest skips such classes
+                    if item.name.startswith("test"):
+                        tests.append(collected(item, f"{node.name}::{item.name}"))
+                elif isinstance(item, ast.ClassDef):
+                    return None
+                elif isinstance(item, ast.Assign) and defines_tests(item.targets):
+                    return None
+            continue
+        return None  # Loops, conditionals and other code may define tests dynamically
+    return tests
+
+class TestDurationHistory:
+    """Exponentially weighted per-test durations, keyed by test source hash."""
+
+    def __init__(self, max_entries: int = 50000, smoothing: float = 0.3):
+        """
+        Initialize the history.
+
+        Args:
+            max_entries: Tests remembered; least recently updated are dropped first
+            smoothing: Weight of the newest duration in the moving average
+        """
+        self.max_entries = max_entries
+        self.smoothing = smoothing
+        self._durations: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, source_hash: str) -> Optional[float]:
+        with self._lock:
+            return self._durations.get(source_hash)
+
+    def record(self, source_hash: str, seconds: float) -> None:
+        with self._lock:
+            previous = self._durations.pop(source_hash, None)
+            self._durations[source_hash] = seconds if previous is None else previous + self.smoothing * (seconds - previous)
+            while len(self._durations) > self.max_entries:
+                self._durations.popitem(last=False)
+
+def usable_shards(entry_point: Optional[CodeFile], shards: int) -> int:
+    """
+    Get how many shards an entry point's tests can actually be split into.
+
+    Args:
+        entry_point: The bundle's test file, if any
+        shards: Shards requested
+
+    Returns:
+        At most `shards`; 1 when the file cannot be sharded
+    """
+    # Languages are versioned, e.g. "python-3.12"
+    if entry_point is None or shards < 2 or not entry_point.language.startswith("python"):
+        return 1
+    tests = collect_tests(entry_point.content)
+    return 1 if tests is None else max(1, min(shards, len(tests)))
+
+def plan_shards(tests: List[CollectedTest], shards: int, history: TestDurationHistory) -> List[List[str]]:
+    """
+    Split tests into shards with balanced expected durations.
+
+    Uses longest-processing-time-first: tests are assigned, slowest first, to
+    the shard with the least expected work. Tests without history are assumed
+    to take the median known duration.
+
+    Args:
+        tests: Tests to distribute
+        shards: Number of shards wanted
+        history: Past per-test durations
+
+    Returns:
+        Node ids per shard; never more shards than tests, and no empty shards
+    """
+    known = {test.node_id: history.get(test.source_hash) for test in tests}
+    durations = sorted(d for d in known.values() if d is not None)
+    default = durations[len(durations) // 2] if durations else 1.0
+    expected = {node_id: default if d is None else d for node_id, d in known.items()}
+
+    shards = max(1, min(shards, len(tests)))
+    loads = [(0.0, i) for i in range(shards)]
+    plan: List[List[str]] = [[] for _ in range(shards)]
+    for node_id in sorted(expected, key=lambda n: expected[n], reverse=True):
+        load, i = heapq.heappop(loads)
+        plan[i].append(node_id)
+        heapq.heappush(loads, (load + expected[node_id], i))
+    return plan
+
+@lru_cache()
+def get_duration_history() -> TestDurationHistory:
+    """Get the process-wide test duration history."""
+    return TestDurationHistory()
@@ -0,0 +1,69 @@
+"""
+Guard worker boot latency: import `app.main` and build the app with `create_app()`
+in fresh interpreters, and fail if that is too slow or if heavy modules that should
+load lazily are pulled in during boot.
+
+Usage:
+    python benchmarks/import_time.py [--runs 5] [--budget-ms 800]
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# Modules that must only be imported on first use
+LAZY_MODULES = [
+    "openai",
+    "app.services.llm.client",
+    "app.services.sandbox.docker",
+    "app.services.sandbox.fargate",
+]
+
+_PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import app.main
+app.main.create_app()
+elapsed = time.perf_counter() - started
+print(json.dumps({"seconds": elapsed, "modules": sorted(sys.modules)}))
+"""
+
+def measure_once() -> dict:
+    """Boot the app in a fresh interpreter and report time and loaded modules."""
+    result = subprocess.run(
+        [sys.executable, "-c", _PROBE],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters to measure")
+    parser.add_argument("--budget-ms", type=float, default=800, help="Maximum median import time")
+    args = parser.parse_args()
+
+    samples = [measure_once() for _ in range(args.runs)]
+    timings_ms = [sample["seconds"] * 1000 for sample in samples]
+    median_ms = statistics.median(timings_ms)
+    print(f"create_app(): median {median_ms:.1f} ms, min {min(timings_ms):.1f} ms, max {max(timings_ms):.1f} ms over {args.runs} runs")
+
+    failed = False
+    eager = [module for module in LAZY_MODULES if module in samples[0]["modules"]]
+    if eager:
+        print(f"FAIL: imported eagerly: {', '.join(eager)}", file=sys.stderr)
+        failed = True
+    if median_ms > args.budget_ms:
+        print(f"FAIL: median import time {median_ms:.1f} ms exceeds budget of {args.budget_ms:.0f} ms", file=sys.stderr)
+        failed = True
+
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,202 @@
 import argparse
+import json
+import resource
+import shutil
+import signal
 import subprocess
 import sys
 import os
+import tempfile
+import threading
+import time
+import xml.etree.ElementTree as ET
 from pathlib import Path
 
+# Prefix of the last stderr line, which the host parses and strips
+USAGE_MARKER = "__SANDBOX_USAGE__"
+# Prefix of the stderr line carrying per-shard results, printed just before the usage line
+SHARDS_MARKER = "__SANDBOX_SHARDS__"
+PUMP_CHUNK_SIZE = 64 * 1024
+CGROUP_DIR = Path("/sys/fs/cgroup")
+
+def _read_cgroup(name):
+    """Read a cgroup v2 file of this container, or None if unavailable."""
+    try:
+        return (CGROUP_DIR / name).read_text()
+    except OSError:
+        return None
+
+def report_usage(timed_out=False):
+    """
+    Print the resources used by the test process as the last stderr line.
+
+    cgroup v2 counters cover the whole container; rusage of our children is
+    the fallback when they are not available. `timed_out` tells the host that
+    the code was stopped at the timeout, `oom_killed` that the kernel killed
+    one of its processes for memory (the container itself then exits normally).
+    """
+    rusage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    usage = {
+        "cpu_time_seconds": rusage.ru_utime + rusage.ru_stime,
+        "peak_memory_bytes": rusage.ru_maxrss * 1024,  # ru_maxrss is in KiB on Linux
+        "process_count": None,
+        "timed_out": timed_out,
+        "oom_killed": False,
+    }
+
+    if (cpu_stat := _read_cgroup("cpu.stat")) is not None:
+        for line in cpu_stat.splitlines():
+            key, _, value = line.partition(" ")
+            if key == "usage_usec":
+                usage["cpu_time_seconds"] = int(value) / 1_000_000
+    if (memory_peak := _read_cgroup("memory.peak")) is not None:
+        usage["peak_memory_bytes"] = int(memory_peak)
+    if (pids_peak := _read_cgroup("pids.peak")) is not None:
+        usage["process_count"] = int(pids_peak)
+    if (memory_events := _read_cgroup("memory.events")) is not None:
+        for line in memory_events.splitlines():
+            key, _, value = line.partition(" ")
+            if key == "oom_kill":
+                usage["oom_killed"] = int(value) > 0
+
+    sys.stdout.flush()
+    print(f"{USAGE_MARKER} {json.dumps(usage)}", file=sys.stderr, flush=True)
+
+def read_durations(report, node_ids):
+    """Sum per-test durations from a pytest JUnit XML report, keyed by node id."""
+    durations = {}
+    try:
+        cases = ET.parse(report).getroot().iter("testcase")
+    except (OSError, ET.ParseError):
+        return durations
+    for case in cases:
+        name = case.get("name", "").split("[")[0]  # Parametrized cases count towards their test
+        class_name = case.get("classname", "").rsplit(".", 1)[-1]
+        node_id = f"{class_name}::{name}" if f"{class_name}::{name}" in node_ids else name
+        durations[node_id] = durations.get(node_id, 0.0) + float(case.get("time") or 0)
+    return durations
+
+def collect_node_ids(entry_path, timeout):
+    """Get the node ids pytest would run, without parameters, or None if collection fails."""
+    try:
+        result = subprocess.run(
+            [sys.executable, "-m", "pytest", "--collect-only", "-q", "-p", "no:cacheprovider", str(entry_path)],
+            capture_output=True,
+            text=True,
+            timeout=timeout,
+        )
+    except subprocess.TimeoutExpired:
+        return None
+    if result.returncode != 0:
+        return None
+    return {line.split("::", 1)[1].split("[")[0] for line in result.stdout.splitlines() if "::" in line}
+
+def pump(pipe, stream, prefix, lock):
+    """Copy a shard's output to one of our streams as it arrives, tagging each line with the shard."""
+    pending = b""
+    while chunk := os.read(pipe.fileno(), PUMP_CHUNK_SIZE):
+        *lines, pending = (pending + chunk).split(b"\n")
+        if len(pending) >= PUMP_CHUNK_SIZE:
+            # Don't hold on to a huge line without newlines
+            lines.append(pending)
+            pending = b""
+        if lines:
+            with lock:
+                stream.buffer.write(b"".join(prefix + line + b"\n" for line in lines))
+                stream.buffer.flush()
+    if pending:
+        with lock:
+            stream.buffer.write(prefix + pending + b"\n")
+            stream.buffer.flush()
+    pipe.close()
+
+def run_shards(entry_path, shards, deadline):
+    """
+    Run each shard of tests in its own pytest process, in parallel.
+
+    Shard output is streamed to our stdout and stderr as it is produced, each
+    line prefixed with its shard, so the host's output caps apply and output
+    so far survives a timeout. A summary per shard follows on stdout, and a
+    report line with per-shard exit codes and per-test durations on stderr.
+
+    Returns:
+        Tuple of (exit code: 0 if every shard passed, else the first failing
+        shard's; whether the deadline was hit)
+    """
+    work_dir = Path(tempfile.mkdtemp())
+    lock = threading.Lock()
+    runs = []
+    for i, node_ids in enumerate(shards):
+        report = work_dir / f"shard-{i}.xml"
+        process = subprocess.Popen(
+            [sys.executable, "-m", "pytest", "-q", "-p", "no:cacheprovider", f"--junitxml={report}",
+             *[f"{entry_path}::{node_id}" for node_id in node_ids]],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            start_new_session=True,  # Lets a timeout kill everything the shard started
+        )
+        prefix = f"[shard {i + 1}/{len(shards)}] ".encode()
+        pumps = [
+            threading.Thread(target=pump, args=(process.stdout, sys.stdout, prefix, lock), daemon=True),
+            threading.Thread(target=pump, args=(process.stderr, sys.stderr, prefix, lock), daemon=True),
+        ]
+        for thread in pumps:
+            thread.start()
+        runs.append((process, pumps, report, node_ids))
+
+    timed_out = False
+    for process, *_ in runs:
+        try:
+            process.wait(timeout=max(deadline - time.monotonic(), 0))
+        except subprocess.TimeoutExpired:
+            os.killpg(process.pid, signal.SIGKILL)
+            process.wait()
+            timed_out = True
+
+    exit_codes = []
+    durations = {}
+    for i, (process, pumps, report, node_ids) in enumerate(runs):
+        for thread in pumps:
+            thread.join(timeout=1)
+        exit_codes.append(process.returncode)
+        print(f"===== shard {i + 1}/{len(runs)}: {len(node_ids)} tests, exit code {process.returncode} =====")
+        durations.update(read_durations(report, node_ids))
+    shutil.rmtree(work_dir, ignore_errors=True)
+
+    sys.stdout.flush()
+    if timed_out:
+        print("Execution timed out", file=sys.stderr)
+    print(f"{SHARDS_MARKER} {json.dumps({'exit_codes': exit_codes, 'durations': durations})}", file=sys.stderr, flush=True)
+    if timed_out:
+        return 1, True
+    return next((code for code in exit_codes if code != 0), 0), False
+
+def run_script(entry_path, timeout):
+    """
+    Run the entry point as a plain script.
+
+    Returns:
+        Tuple of (exit code, whether the timeout was hit)
+    """
+    try:
+        # The child writes straight to our stdout/stderr instead of being buffered
+        # here; the host caps how much of it is kept.
+        result = subprocess.run(
+            ["python", str(entry_path)],
+            timeout=timeout,
+        )
+        return result.returncode, False
+    except subprocess.TimeoutExpired:
+        print("Execution timed out", file=sys.stderr)
+        return 1, True
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--entrypoint", required=True, help="Main script to run")
+    parser.add_argument("--timeout", type=float, default=5, help="Seconds the script may run")
+    parser.add_argument("--shard-plan", help="JSON file listing the test node ids of each shard")
     args = parser.parse_args()
+    deadline = time.monotonic() + args.timeout
 
     entry_path = Path(args.entrypoint)
     if not entry_path.exists():
@@ -25,20 +214,23 @@ def main():
     for file in code_dir.iterdir():
         print(f"  {file.name}", file=sys.stderr)
 
-    try:
-        result = subprocess.run(
-            ["python", str(entry_path)],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            timeout=5,
-        )
-        print(result.stdout)
-        print(result.stderr, file=sys.stderr)
-        sys.exit(result.returncode)
-    except subprocess.TimeoutExpired:
-        print("Execution timed out", file=sys.stderr)
-        sys.exit(1)
+    # Flush our own debug output before the child starts writing to the same streams
+    sys.stderr.flush()
+
+    if args.shard_plan:
+        # Shards run the tests with pytest; only do so if pytest sees exactly the
+        # planned tests, so no test is silently dropped (e.g. one created dynamically)
+        shards = json.loads(Path(args.shard_plan).read_text())["shards"]
+        planned = {node_id for shard in shards for node_id in shard}
+        if collect_node_ids(entry_path, max(deadline - time.monotonic(), 0)) == planned:
+            exit_code, timed_out = run_shards(entry_path, shards, deadline)
+            report_usage(timed_out)
+            sys.exit(exit_code)
+        print("Running unsharded: pytest collects different tests than the shard plan", file=sys.stderr, flush=True)
+
+    exit_code, timed_out = run_script(entry_path, max(deadline - time.monotonic(), 0))
+    report_usage(timed_out)
+    sys.exit(exit_code)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,44 @@
+import pytest
+from app.services.bundle_store import BundleStore
+from app.models.code_execution import CodeBundle, CodeFile
+
+def make_bundle(*names: str) -> CodeBundle:
+    bundle = CodeBundle()
+    bundle.add_file(CodeFile(name="test.py", content="def test_ok(): pass", language="python", is_entry_point=True))
+    for name in names:
+        bundle.add_file(CodeFile(name=name, content="x = 1", language="python"))
+    return bundle
+
+@pytest.mark.parametrize("name", ["../../../tmp/evil.py", "/etc/cron.d/x", "pkg\\evil.py", "pkg/../../evil.py", "pkg//a.py"])
+def test_put_rejects_unsafe_file_names(name):
+    store = BundleStore(max_bytes=1024, max_bundles=10)
+    with pytest.raises(ValueError):
+        store.put(make_bundle(name))
+
+def test_put_accepts_nested_relative_names():
+    store = BundleStore(max_bytes=1024, max_bundles=10)
+    bundle_id = store.put(make_bundle("pkg/helpers.py"))
+    assert "pkg/helpers.py" in store.get(bundle_id).files
+
+def test_invalid_derived_bundle_is_not_stored():
+    store = BundleStore(max_bytes=1024, max_bundles=10)
+    bundle_id = store.put(make_bundle())
+    with pytest.raises(ValueError):
+        store.derive(bundle_id, [], removed_files=["test.py"])
+    assert list(store._manifests) == [bundle_id]
+
+def test_digest_is_computed_once_per_file(monkeypatch):
+    file = CodeFile(name="a.py", content="x = 1", language="python-3.12")
+    digest = file.digest
+    monkeypatch.setattr(file, "content", "x = 2")
+    assert file.digest == digest
+
+def test_bundle_api_rejects_unknown_languages():
+    from fastapi.testclient import TestClient
+    from app.main import create_app
+
+    client = TestClient(create_app())
+    files = [{"name": "test.py", "content": "x", "language": "3.12\nFROM attacker/image:latest", "is_entry_point": True}]
+    assert client.post("/api/v1/bundles", json={"files": files}).status_code == 422
+    files[0]["language"] = "python-3.12"
+    assert client.post("/api/v1/bundles", json={"files": files}).status_code == 200
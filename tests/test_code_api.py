@@ -0,0 +1,40 @@
+import pytest
+from starlette.requests import Request
+from app.api.code import get_priority, get_tenant
+from app.core.config import get_settings
+from app.services.sandbox.scheduler import Priority
+
+def make_request(**headers) -> Request:
+    return Request({
+        "type": "http",
+        "method": "POST",
+        "path": "/api/v1/code",
+        "headers": [(k.replace("_", "-").lower().encode(), v.encode()) for k, v in headers.items()],
+        "client": ("10.0.0.1", 1234),
+    })
+
+def test_tenant_sources_cannot_collide():
+    keyed = get_tenant(make_request(X_API_Key="secret"))
+    assert keyed.startswith("key-") and "secret" not in keyed
+    assert get_tenant(make_request(X_Tenant_ID=keyed)) == f"tenant-{keyed}"
+    assert get_tenant(make_request()) == "ip-10.0.0.1"
+
+def test_header_tenants_are_always_batch():
+    request = make_request(X_Tenant_ID="grader", X_Priority="interactive")
+    assert get_priority(request, get_tenant(request)) == Priority.BATCH
+
+def test_keyed_and_address_tenants_default_to_interactive():
+    for request in (make_request(X_API_Key="secret"), make_request()):
+        assert get_priority(request, get_tenant(request)) == Priority.INTERACTIVE
+    request = make_request(X_Priority="batch")
+    assert get_priority(request, get_tenant(request)) == Priority.BATCH
+
+def test_configured_batch_tenants_are_always_batch(monkeypatch):
+    request = make_request(X_API_Key="grader-key")
+    monkeypatch.setattr(get_settings(), "SANDBOX_BATCH_TENANTS", [get_tenant(request)])
+    assert get_priority(request, get_tenant(request)) == Priority.BATCH
+
+def test_unknown_priority_is_rejected():
+    request = make_request(X_Priority="urgent")
+    with pytest.raises(ValueError):
+        get_priority(request, get_tenant(request))
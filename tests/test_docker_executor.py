@@ -0,0 +1,27 @@
+from app.models.code_execution import CodeBundle, CodeFile
+from app.services.sandbox.docker import DockerSandboxExecutor
+
+def make_executor() -> DockerSandboxExecutor:
+    # Skip __init__, which needs a container CLI
+    return DockerSandboxExecutor.__new__(DockerSandboxExecutor)
+
+def make_bundle(*files: CodeFile) -> CodeBundle:
+    bundle = CodeBundle()
+    for file in files:
+        bundle.add_file(file)
+    return bundle
+
+def test_implementation_import_is_added_to_two_file_bundles():
+    test_file = CodeFile(name="test.py", content="def test_a(): pass", language="python-3.12", is_entry_point=True)
+    bundle = make_bundle(CodeFile(name="implementation.py", content="x = 1", language="python-3.12"), test_file)
+    make_executor()._ensure_test_imports_implementation(bundle)
+    assert bundle.files["test.py"].content.startswith("from implementation import *")
+    assert test_file.content == "def test_a(): pass"
+
+def test_multi_file_bundles_are_left_alone():
+    bundle = make_bundle(
+        CodeFile(name="pkg/helpers.py", content="x = 1", language="python-3.12"),
+        CodeFile(name="main.py", content="from pkg.helpers import x", language="python-3.12", is_entry_point=True)
+    )
+    make_executor()._ensure_test_imports_implementation(bundle)
+    assert bundle.files["main.py"].content == "from pkg.helpers import x"
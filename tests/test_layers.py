@@ -0,0 +1,103 @@
+import subprocess
+import pytest
+from app.services.sandbox.layers import LAYER_REPOSITORY, DependencyLayerCache, normalize_requirements, requirements_hash
+
+class FakeLayerCache(DependencyLayerCache):
+    """Layer cache whose container CLI calls are answered in memory."""
+
+    def __init__(self, budget_bytes: int, layer_size: int = 60):
+        super().__init__("docker", wheelhouse_dir=None, budget_bytes=budget_bytes, build_timeout=10)
+        self.wheelhouse_dir = "/wheelhouse"
+        self.layer_size = layer_size
+        self.base_ids = {"python-sandbox:python-3.12": "sha256:base-1"}
+        self.failing_removals = set()
+        self.builds = []
+        self.removed = []
+
+    def _run(self, cmd, timeout, input=None):
+        if cmd[1] == "build":
+            self.builds.append(cmd[cmd.index("-t") + 1])
+            return subprocess.CompletedProcess(cmd, 0, "", "")
+        if cmd[1:3] == ["image", "rm"]:
+            if cmd[3] in self.failing_removals:
+                return subprocess.CompletedProcess(cmd, 1, "", "image is being used")
+            self.removed.append(cmd[3])
+            return subprocess.CompletedProcess(cmd, 0, "", "")
+        if cmd[1:3] == ["image", "inspect"] and "{{.Id}}" in cmd:
+            image_id = self.base_ids.get(cmd[-1])
+            return subprocess.CompletedProcess(cmd, 0 if image_id else 1, image_id or "", "")
+        if cmd[1:3] == ["image", "inspect"]:
+            size = 0 if cmd[-1].startswith("sha256:") else self.layer_size
+            return subprocess.CompletedProcess(cmd, 0, f"{size}\n", "")
+        raise AssertionError(f"Unexpected command: {cmd}")
+
+BASE = "python-sandbox:python-3.12"
+
+def test_normalize_requirements_canonicalizes_and_dedupes():
+    assert normalize_requirements(["NumPy==2.1.0", "numpy == 2.1.0", "Typing_Extensions>=4", "hypothesis[NumPy]"]) == [
+        "hypothesis[numpy]", "numpy==2.1.0", "typing-extensions>=4"
+    ]
+
+@pytest.mark.parametrize("requirement", ["numpy; os.system('x')", "-e git+https://x", "../wheel.whl", "numpy @ https://x"])
+def test_normalize_requirements_rejects_non_specifiers(requirement):
+    with pytest.raises(ValueError):
+        normalize_requirements([requirement])
+
+def test_hash_depends_on_base_image_id():
+    assert requirements_hash("sha256:a", ["numpy"]) != requirements_hash("sha256:b", ["numpy"])
+
+def test_layers_are_built_once_and_reused():
+    cache = FakeLayerCache(budget_bytes=1000)
+    image = cache.resolve(BASE, ["numpy"])
+    cache.release(image)
+    assert cache.resolve(BASE, ["NumPy"]) == image
+    assert cache.builds == [image]
+    assert cache.resolve(BASE, []) == BASE
+
+def test_rebuilt_base_image_gets_new_layers():
+    cache = FakeLayerCache(budget_bytes=1000)
+    old = cache.resolve(BASE, ["numpy"])
+    cache.base_ids[BASE] = "sha256:base-2"
+    assert cache.resolve(BASE, ["numpy"]) != old
+
+def test_least_recently_used_unpinned_layer_is_evicted():
+    cache = FakeLayerCache(budget_bytes=100)
+    a = cache.resolve(BASE, ["a"])
+    cache.release(a)
+    b = cache.resolve(BASE, ["b"])
+    cache.release(b)
+    assert cache.removed == [a]
+    assert cache.total_bytes == 60
+
+def test_pinned_layers_are_not_evicted_until_released():
+    cache = FakeLayerCache(budget_bytes=100)
+    a = cache.resolve(BASE, ["a"])
+    b = cache.resolve(BASE, ["b"])
+    assert cache.removed == []
+    assert cache.total_bytes == 120
+
+    cache.release(a)
+    assert cache.removed == [a]
+    cache.release(b)
+    assert cache.removed == [a]
+
+def test_failed_removal_stays_charged_to_budget():
+    cache = FakeLayerCache(budget_bytes=100)
+    a = cache.resolve(BASE, ["a"])
+    cache.failing_removals.add(a)
+    cache.release(a)
+    b = cache.resolve(BASE, ["b"])
+    cache.release(b)
+    # `a` could not be removed, so the newer `b` goes instead and `a` still counts
+    assert cache.removed == [b]
+    assert cache.total_bytes == 60
+    assert a.startswith(f"{LAYER_REPOSITORY}:")
+
+@pytest.mark.parametrize("image", ["python-sandbox:3.12\nFROM attacker/image:latest", "python-sandbox", "evil image:tag", "python-sandbox:../x"])
+def test_resolve_rejects_malformed_base_images(image):
+    cache = FakeLayerCache(budget_bytes=1000)
+    with pytest.raises(ValueError):
+        cache.resolve(image, [])
+    with pytest.raises(ValueError):
+        cache.resolve(image, ["numpy"])
+    assert cache.builds == []
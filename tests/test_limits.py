@@ -0,0 +1,56 @@
+from app.services.sandbox.limits import AdaptiveLimitPolicy, ResourceLimits, UsageSample, percentile
+
+DEFAULTS = ResourceLimits(memory_mb=512, cpus=1.0, pids=64, timeout=30.0)
+MINIMUMS = ResourceLimits(memory_mb=64, cpus=0.25, pids=16, timeout=5.0)
+SMALL_RUN = UsageSample(wall_time_seconds=2.0, cpu_time_seconds=1.0, peak_memory_bytes=40 * 1024 ** 2, process_count=4)
+
+def make_policy(**kwargs) -> AdaptiveLimitPolicy:
+    return AdaptiveLimitPolicy(DEFAULTS, MINIMUMS, fraction=0.95, headroom=1.5, min_samples=10, window=20, **kwargs)
+
+def test_percentile_is_nearest_rank():
+    values = list(range(1, 21))
+    assert percentile(values, 0.95) == 19
+    assert percentile(values, 0.5) == 10
+    assert percentile([7.0], 0.95) == 7.0
+
+def test_defaults_until_enough_samples():
+    policy = make_policy()
+    for _ in range(9):
+        policy.record("python-3.12", None, SMALL_RUN)
+    assert policy.limits_for("python-3.12") == DEFAULTS
+
+def test_limits_are_clamped_between_minimums_and_defaults():
+    policy = make_policy()
+    for _ in range(10):
+        policy.record("python-3.12", None, SMALL_RUN)
+    # 40 MiB * 1.5 and 4 pids * 1.5 are below the minimums; 2s * 1.5 is below 5s
+    assert policy.limits_for("python-3.12") == ResourceLimits(memory_mb=64, cpus=0.75, pids=16, timeout=5.0)
+
+    big_run = UsageSample(wall_time_seconds=60.0, cpu_time_seconds=240.0, peak_memory_bytes=2 * 1024 ** 3, process_count=500)
+    for _ in range(20):
+        policy.record("python-3.12", None, big_run)
+    assert policy.limits_for("python-3.12") == DEFAULTS
+
+def test_hitting_a_limit_restores_the_defaults():
+    policy = make_policy()
+    for _ in range(10):
+        policy.record("python-3.12", None, SMALL_RUN)
+    assert policy.limits_for("python-3.12") != DEFAULTS
+    policy.record("python-3.12", None, SMALL_RUN, hit_limit=True)
+    assert policy.limits_for("python-3.12") == DEFAULTS
+
+def test_disabled_policy_keeps_no_history():
+    policy = make_policy(enabled=False)
+    for _ in range(10):
+        policy.record("python-3.12", "key-a", SMALL_RUN)
+    assert policy.limits_for("python-3.12", "key-a") == DEFAULTS
+    assert not policy._history and not policy._tenant_history
+
+def test_tenant_keys_are_capped_and_fall_back_to_language():
+    policy = make_policy(max_tenant_keys=2)
+    for tenant in ("key-a", "key-b", "key-c"):
+        for _ in range(10):
+            policy.record("python-3.12", tenant, SMALL_RUN)
+    assert list(policy._tenant_history) == [("python-3.12", "key-b"), ("python-3.12", "key-c")]
+    # The dropped tenant still gets the language's adapted limits
+    assert policy.limits_for("python-3.12", "key-a") == policy.limits_for("python-3.12")
@@ -0,0 +1,92 @@
+import time
+import asyncio
+import threading
+from app.core.metrics import metrics
+from app.services.llm.client import LLMClient
+from app.services.llm.hedged import HedgedLLMClient
+from app.services.llm.mock_client import MockLLMClient
+
+async def collect(client, **kwargs) -> str:
+    chunks = [c async for c in client.chat_completion(messages=[{"role": "user", "content": "add"}], **kwargs)]
+    return "".join(c.choices[0].delta.content for c in chunks)
+
+def counter(name: str) -> float:
+    return metrics.snapshot()["counters"].get(name, 0)
+
+def test_hedge_wins_when_primary_is_slow():
+    async def scenario():
+        primary = MockLLMClient(delay=0.0, first_token_delay=5.0)
+        secondary = MockLLMClient(delay=0.0, first_token_delay=0.01)
+        client = HedgedLLMClient(primary, secondary, hedge_after=0.05)
+        won_by_hedge = counter("llm.hedge.won_by_hedge")
+
+        started = time.monotonic()
+        text = await collect(client)
+        assert time.monotonic() - started < 1.0
+        assert text == "".join(c.choices[0].delta.content for c in secondary.mock_responses)
+        assert counter("llm.hedge.won_by_hedge") == won_by_hedge + 1
+
+    asyncio.run(scenario())
+
+def test_no_hedge_when_primary_is_fast():
+    async def scenario():
+        primary = MockLLMClient(delay=0.0, first_token_delay=0.0)
+        secondary = MockLLMClient(delay=0.0, first_token_delay=0.0)
+        client = HedgedLLMClient(primary, secondary, hedge_after=0.5)
+        started = counter("llm.hedge.started")
+
+        await collect(client)
+        assert counter("llm.hedge.started") == started
+
+    asyncio.run(scenario())
+
+def test_hedge_budget_limits_hedges():
+    async def scenario():
+        primary = MockLLMClient(delay=0.0, first_token_delay=0.05)
+        secondary = MockLLMClient(delay=0.0, first_token_delay=0.05)
+        client = HedgedLLMClient(primary, secondary, hedge_after=0.0, budget_ratio=0.0, budget_burst=1)
+        started = counter("llm.hedge.started")
+
+        for _ in range(3):
+            await collect(client)
+        assert counter("llm.hedge.started") == started + 1
+
+    asyncio.run(scenario())
+
+class FakeStream:
+    def __init__(self):
+        self.closed = threading.Event()
+
+    def __iter__(self):
+        return iter([])
+
+    def close(self):
+        self.closed.set()
+
+class FakeCompletions:
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.streams = []
+
+    def create(self, **kwargs):
+        time.sleep(self.latency)
+        stream = FakeStream()
+        self.streams.append(stream)
+        return stream
+
+def test_stream_created_after_cancellation_is_closed():
+    async def scenario():
+        completions = FakeCompletions(latency=0.2)
+        client = LLMClient.__new__(LLMClient)
+        client.client = type("FakeOpenAI", (), {"chat": type("Chat", (), {"completions": completions})})()
+
+        task = asyncio.ensure_future(collect(client))
+        await asyncio.sleep(0.05)  # Still inside create()
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+        await asyncio.sleep(0.4)
+        assert len(completions.streams) == 1
+        assert completions.streams[0].closed.is_set()
+
+    asyncio.run(scenario())
@@ -0,0 +1,75 @@
+import io
+import os
+from app.services.sandbox.output import BoundedCapture, OutputStore
+
+EXECUTION_IDS = [f"{i:032x}" for i in range(4)]
+
+def test_short_output_is_kept_whole():
+    capture = BoundedCapture(head_bytes=8, tail_bytes=8)
+    capture.feed(b"hello ")
+    capture.feed(b"world")
+    assert capture.text() == "hello world"
+    assert not capture.truncated
+
+def test_long_output_keeps_head_and_tail():
+    capture = BoundedCapture(head_bytes=4, tail_bytes=4)
+    for chunk in (b"abc", b"defghij", b"klmnop"):
+        capture.feed(chunk)
+    assert capture.truncated
+    assert capture.total_bytes == 16
+    assert capture.text() == "abcd\n... [8 bytes truncated] ...\nmnop"
+
+def test_spill_stops_at_its_limit():
+    spill = io.BytesIO()
+    capture = BoundedCapture(head_bytes=2, tail_bytes=2, spill=spill, spill_limit=5)
+    capture.feed(b"abc")
+    capture.feed(b"defgh")
+    assert spill.getvalue() == b"abcde"
+    assert capture.spilled_bytes == 5
+    assert capture.total_bytes == 8
+
+def store_run(store: OutputStore, execution_id: str, stdout: bytes, stderr: bytes = b"", **kwargs) -> None:
+    for stream, data in (("stdout", stdout), ("stderr", stderr)):
+        with store.open(execution_id, stream) as f:
+            f.write(data)
+    store.finish(execution_id, **kwargs)
+
+def test_oldest_runs_are_evicted_over_budget(tmp_path):
+    store = OutputStore(str(tmp_path), max_bytes_per_stream=100, budget_bytes=25)
+    for execution_id in EXECUTION_IDS[:3]:
+        store_run(store, execution_id, b"x" * 10)
+    assert store.get(EXECUTION_IDS[0], "stdout") is None
+    assert store.get(EXECUTION_IDS[1], "stdout") is not None
+    assert store.get(EXECUTION_IDS[2], "stdout") is not None
+    assert store.total_bytes == 20
+
+def test_empty_runs_are_not_kept(tmp_path):
+    store = OutputStore(str(tmp_path), max_bytes_per_stream=100, budget_bytes=100)
+    store_run(store, EXECUTION_IDS[0], b"")
+    assert not (tmp_path / EXECUTION_IDS[0]).exists()
+    assert store.total_bytes == 0
+
+def test_finish_cuts_streams_down(tmp_path):
+    store = OutputStore(str(tmp_path), max_bytes_per_stream=100, budget_bytes=100)
+    store_run(store, EXECUTION_IDS[0], b"out", b"err\n__SANDBOX_USAGE__ {}\n", max_bytes={"stderr": 4})
+    assert store.get(EXECUTION_IDS[0], "stderr").read_bytes() == b"err\n"
+    assert store.total_bytes == 7
+
+def test_existing_runs_are_indexed_oldest_first(tmp_path):
+    for i, execution_id in enumerate(EXECUTION_IDS[:3]):
+        (tmp_path / execution_id).mkdir()
+        (tmp_path / execution_id / "stdout.log").write_bytes(b"x" * 10)
+        os.utime(tmp_path / execution_id, (1000 + i, 1000 + i))
+
+    store = OutputStore(str(tmp_path), max_bytes_per_stream=100, budget_bytes=25)
+    assert store.get(EXECUTION_IDS[0], "stdout") is None
+    assert store.total_bytes == 20
+    store_run(store, EXECUTION_IDS[3], b"x" * 10)
+    assert store.get(EXECUTION_IDS[1], "stdout") is None
+    assert store.get(EXECUTION_IDS[3], "stdout") is not None
+
+def test_get_rejects_unknown_ids_and_streams(tmp_path):
+    store = OutputStore(str(tmp_path), max_bytes_per_stream=100, budget_bytes=100)
+    store_run(store, EXECUTION_IDS[0], b"out")
+    assert store.get("../" + EXECUTION_IDS[0], "stdout") is None
+    assert store.get(EXECUTION_IDS[0], "../stdout") is None
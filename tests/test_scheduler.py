@@ -0,0 +1,108 @@
+import time
+import asyncio
+from app.services.sandbox.scheduler import OTHER_TENANTS, SandboxScheduler
+
+def make_scheduler(**kwargs) -> SandboxScheduler:
+    options = dict(
+        max_concurrency=1,
+        max_queue_depth=10,
+        max_tenant_queue_depth=10,
+        batch_queue_ratio=0.5,
+        tenant_rate=100.0,
+        tenant_burst=100
+    )
+    options.update(kwargs)
+    return SandboxScheduler(**options)
+
+def test_cancel_while_slot_frees_does_not_leak_slot():
+    async def scenario():
+        scheduler = make_scheduler()
+        loop = asyncio.get_running_loop()
+
+        # The running job is a plain future, so finishing it queues `_job_done` right away
+        gate = loop.create_future()
+        running = asyncio.create_task(scheduler.run(lambda: gate, "a"))
+        await asyncio.sleep(0)
+        queued = asyncio.create_task(scheduler.run(lambda: asyncio.sleep(0, "queued"), "b"))
+        await asyncio.sleep(0)
+        assert scheduler.running == 1 and scheduler.queue_depth == 1
+
+        # Free the slot and cancel the queued caller in the same tick: the dispatcher
+        # sees an already-cancelled future before the caller can withdraw itself
+        gate.set_result("done")
+        queued.cancel()
+
+        assert await running == "done"
+        await asyncio.gather(queued, return_exceptions=True)
+        assert scheduler.running == 0 and scheduler.queue_depth == 0
+
+        # Later jobs still get the slot
+        result = await asyncio.wait_for(scheduler.run(lambda: asyncio.sleep(0, "later"), "c"), timeout=1)
+        assert result == "later"
+        assert scheduler.running == 0
+
+    asyncio.run(scenario())
+
+def test_idle_tenant_state_is_swept():
+    async def scenario():
+        scheduler = make_scheduler(max_concurrency=4, idle_sweep_interval=0.0)
+        for i in range(20):
+            await scheduler.run(lambda: asyncio.sleep(0), f"tenant-{i}")
+
+        # Let every bucket refill, then admit one more job to trigger a sweep
+        for bucket in scheduler._buckets.values():
+            bucket.updated = time.monotonic() - 10
+        await scheduler.run(lambda: asyncio.sleep(0), "last")
+        assert set(scheduler._buckets) == {"last"}
+        assert set(scheduler._last_finish) <= {"last"}
+
+    asyncio.run(scenario())
+
+def test_metric_tenants_are_capped():
+    scheduler = make_scheduler(max_metric_tenants=2, tenant_weights={"vip": 2.0})
+    assert [scheduler._metric_tenant(t) for t in ("x", "y", "z", "vip", "x")] == ["x", "y", OTHER_TENANTS, "vip", "x"]
+
+def test_sharded_job_holds_a_slot_per_shard():
+    async def scenario():
+        scheduler = make_scheduler(max_concurrency=4)
+        loop = asyncio.get_running_loop()
+
+        gate = loop.create_future()
+        sharded = asyncio.create_task(scheduler.run(lambda: gate, "a", slots=3))
+        await asyncio.sleep(0)
+        assert scheduler.running == 3
+
+        # One slot is left: a job needing two waits, and the job queued behind it is not let past
+        big = asyncio.create_task(scheduler.run(lambda: asyncio.sleep(0, "big"), "b", slots=2))
+        small = asyncio.create_task(scheduler.run(lambda: asyncio.sleep(0, "small"), "b"))
+        await asyncio.sleep(0)
+        assert scheduler.running == 3 and scheduler.queue_depth == 2
+
+        gate.set_result("done")
+        assert await asyncio.wait_for(asyncio.gather(sharded, big, small), timeout=1) == ["done", "big", "small"]
+        assert scheduler.running == 0 and scheduler.queue_depth == 0
+
+        # Requests beyond the pool are capped rather than waiting forever
+        assert await asyncio.wait_for(scheduler.run(lambda: asyncio.sleep(0, "capped"), "d", slots=10), timeout=1) == "capped"
+
+    asyncio.run(scenario())
+
+def test_sharded_jobs_advance_finish_tags_by_slots():
+    async def scenario():
+        scheduler = make_scheduler(max_concurrency=2)
+        gate = asyncio.get_running_loop().create_future()
+        running = asyncio.create_task(scheduler.run(lambda: gate, "x", slots=2))
+        await asyncio.sleep(0)
+
+        order = []
+        jobs = [
+            asyncio.create_task(scheduler.run(lambda t=t: asyncio.sleep(0, order.append(t)), t, slots=slots))
+            for t, slots in (("a", 2), ("a", 2), ("b", 1), ("b", 1), ("b", 1))
+        ]
+        await asyncio.sleep(0)
+        gate.set_result(None)
+        await asyncio.gather(running, *jobs)
+        # Finish tags: a=4,6 and b=3,4,5, so "b" runs two jobs for each sharded "a" job
+        assert order == ["b", "a", "b", "b", "a"]
+
+    asyncio.run(scenario())
@@ -0,0 +1,84 @@
+import textwrap
+import pytest
+from app.services.sandbox import sharding
+from app.services.sandbox.sharding import collect_tests, plan_shards
+
+def collect(source: str):
+    tests = collect_tests(textwrap.dedent(source))
+    return None if tests is None else [test.node_id for test in tests]
+
+def test_collects_pytest_functions_and_classes():
+    source = """
+        import pytest
+
+        def test_a(): pass
+
+        class TestMath:
+            def test_b(self): pass
+            def helper(self): pass
+
+        if __name__ == "__main__":
+            import sys
+            sys.exit(pytest.main([__file__]))
+    """
+    assert collect(source) == ["test_a", "TestMath::test_b"]
+
+def test_collects_unittest_cases_of_any_name():
+    source = """
+        import unittest
+
+        class AddTests(unittest.TestCase):
+            def test_one(self): pass
+            def test_two(self): pass
+
+        if __name__ == "__main__":
+            unittest.main(verbosity=2)
+    """
+    assert collect(source) == ["AddTests::test_one", "AddTests::test_two"]
+
+@pytest.mark.parametrize("source", [
+    # Without a test runner, `python test.py` runs no test functions at all
+    "def test_a(): pass\ndef test_b(): pass\n",
+    # unittest.main() would not run plain functions, pytest would
+    "import unittest\ndef test_a(): pass\nif __name__ == '__main__':\n    unittest.main()\n",
+    # Dynamically created tests cannot be named from the source
+    "import pytest\nfor i in range(3):\n    globals()[f'test_{i}'] = lambda: None\nif __name__ == '__main__':\n    pytest.main()\n",
+    "import pytest\ntest_x = lambda: None\nif __name__ == '__main__':\n    pytest.main()\n",
+    # Inherited test methods
+    "import unittest\nclass Base(unittest.TestCase):\n    def test_a(self): pass\nclass TestMore(Base):\n    def test_b(self): pass\nif __name__ == '__main__':\n    unittest.main()\n",
+    # Runner options that change which tests run
+    "import pytest\ndef test_a(): pass\nif __name__ == '__main__':\n    pytest.main(['-k', 'a', __file__])\n",
+    "def broken(:\n",
+])
+def test_unshardable_files(source):
+    assert collect(source) is None
+
+def test_plan_balances_by_history():
+    source = """
+        import pytest
+        def test_slow(): pass
+        def test_medium(): pass
+        def test_fast_1(): pass
+        def test_fast_2(): pass
+        if __name__ == "__main__":
+            pytest.main()
+    """
+    tests = collect_tests(textwrap.dedent(source))
+    history = sharding.TestDurationHistory()
+    for test, seconds in zip(tests, [4.0, 2.0, 1.0, 1.0]):
+        history.record(test.source_hash, seconds)
+
+    plan = plan_shards(tests, 2, history)
+    assert sorted(map(sorted, plan)) == [["test_fast_1", "test_fast_2", "test_medium"], ["test_slow"]]
+    assert plan_shards(tests, 10, history) == [[t.node_id] for t in sorted(tests, key=lambda t: -history.get(t.source_hash))]
+
+def test_usable_shards_is_bounded_by_tests():
+    from app.models.code_execution import CodeFile
+
+    source = "import pytest\ndef test_a(): pass\ndef test_b(): pass\nif __name__ == '__main__':\n    pytest.main()\n"
+    entry_point = CodeFile(name="test.py", content=source, language="python-3.12", is_entry_point=True)
+    assert sharding.usable_shards(entry_point, 4) == 2
+    assert sharding.usable_shards(entry_point, 1) == 1
+    assert sharding.usable_shards(CodeFile(name="test.py", content="def test_a(): pass\n", language="python-3.12"), 4) == 1
+    assert sharding.usable_shards(CodeFile(name="test.js", content=source, language="javascript"), 4) == 1
+    assert sharding.usable_shards(None, 4) == 1